@@ -0,0 +1,109 @@
+import asyncio
+import hashlib
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from fastapi.responses import Response
+from .responses import FastJSONResponse
+
+
+@dataclass
+class CachedResponse:
+    '''
+    快取的回應內容
+    '''
+
+    body: bytes
+    media_type: str
+    headers: dict  # 端點自訂的標頭(X-開頭)，例如分頁游標
+
+
+class ResponseCache:
+    '''
+    API回應快取：LRU淘汰、限制筆數與總位元組數，並合併同時進行的相同查詢
+    '''
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()  # 快取內容：key -> CachedResponse
+        self.inflight = {}  # 進行中的查詢：key -> asyncio.Task
+
+        # 程序識別碼：重新啟動後資料版本會歸零，加入ETag避免與重啟前的版本混淆
+        self.boot_id = uuid.uuid4().hex
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    # 建立快取鍵：端點路徑、查詢參數、回傳格式與資料表版本
+    @staticmethod
+    def make_key(path, params, fmt, versions):
+        params = '&'.join(f'{key}={value}' for key, value in sorted(params))
+        versions = ','.join(f'{table}:{version}' for table, version in versions)
+        return f'{path}?{params}|{fmt}|{versions}'
+
+    # 由快取鍵計算ETag：資料版本相同時ETag不變，不需查詢資料庫即可判斷
+    def etag(self, key):
+        digest = hashlib.blake2b(
+            f'{self.boot_id}|{key}'.encode('utf-8'), digest_size=16).hexdigest()
+        return f'"{digest}"'
+
+    # 取得快取內容，若不存在則執行build建立；相同的key同時只會執行一次build
+    async def get_or_build(self, key, build):
+        cached = self.entries.get(key)
+        if cached is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return cached
+
+        # 已有相同查詢進行中：等待其結果；build於獨立的工作執行，任一請求取消時不影響其他等待者
+        task = self.inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self.__build(key, build))
+            task.add_done_callback(lambda task: task.cancelled() or task.exception())  # 無等待者時不產生未讀取例外的警告
+            self.inflight[key] = task
+
+        return await asyncio.shield(task)
+
+    # 執行build並寫入快取，完成後移除進行中的紀錄
+    async def __build(self, key, build):
+        try:
+            cached = self.to_cached(await build())
+            self.put(key, cached)
+            return cached
+        finally:
+            del self.inflight[key]
+
+    # 寫入快取，並依LRU淘汰超出筆數或位元組上限的內容
+    def put(self, key, cached):
+        if len(cached.body) > self.max_bytes:
+            return
+
+        if key in self.entries:
+            self.total_bytes -= len(self.entries.pop(key).body)
+
+        self.entries[key] = cached
+        self.total_bytes += len(cached.body)
+
+        while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= len(evicted.body)
+
+    # 清除所有快取內容
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+    # 將端點的回傳結果(Dict或Response)轉為可快取的位元組內容
+    @staticmethod
+    def to_cached(result):
+        if not isinstance(result, Response):
+            result = FastJSONResponse(result)
+        headers = {key: value for key, value in result.headers.items()
+                   if key.lower().startswith('x-')}
+        return CachedResponse(body=bytes(result.body), media_type=result.media_type, headers=headers)
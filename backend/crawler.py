@@ -0,0 +1,221 @@
+import time
+import random
+import asyncio
+import threading
+from dataclasses import dataclass
+from urllib import parse
+import httpx
+from .metrics import CRAWLER_REQUESTS, CRAWLER_RETRIES, CRAWLER_BYTES, CRAWLER_CIRCUIT_OPEN
+from .ratelimit import parse_retry_after
+
+
+class FetchError(Exception):
+    '''
+    爬取失敗：重試次數用盡或伺服器回應不可重試的錯誤
+    '''
+
+    def __init__(self, url, reason) -> None:
+        super().__init__(f'{url} 爬取失敗：{reason}')
+        self.url = url
+        self.reason = reason
+
+
+class CircuitOpenError(FetchError):
+    '''
+    主機熔斷中：該主機連續失敗過多，請求等待超過上限仍未恢復
+    '''
+
+
+@dataclass
+class RetryPolicy:
+    '''
+    重試策略：連線錯誤、逾時、指定的狀態碼或回應內容驗證失敗時重試
+    第n次重試前等待 backoff_factor × 2^(n-1) 秒(上限max_delay)，並隨機縮短至多jitter比例，避免同時重試
+    '''
+
+    max_retries: int = 5
+    backoff_factor: float = 3
+    max_delay: float = 60
+    jitter: float = 0.5
+    retry_statuses: tuple = (429, 500, 502, 503, 504)
+
+    # 第attempt次重試前的等待秒數
+    def delay(self, attempt):
+        delay = min(self.backoff_factor * 2 ** (attempt - 1), self.max_delay)
+        return delay * (1 - random.uniform(0, self.jitter))
+
+
+class CircuitBreaker:
+    '''
+    熔斷器：主機連續失敗達failure_threshold次時暫停請求reset_timeout秒，期間的請求等待至暫停結束
+    暫停結束後僅放行一個試探請求，成功則恢復，失敗則再次暫停；等待超過max_wait秒仍未恢復時，請求拋出CircuitOpenError
+    '''
+
+    def __init__(self, failure_threshold=20, reset_timeout=60, max_wait=600) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_wait = max_wait
+        self.failures = {}  # 主機名稱 -> 連續失敗次數
+        self.opened_at = {}  # 主機名稱 -> 暫停開始時間(monotonic)
+        self.probing = {}  # 主機名稱 -> 試探請求的開始時間(monotonic)
+        self.lock = threading.Lock()  # 熔斷狀態跨資料更新保留，可能由不同執行緒的事件迴圈存取
+
+    # 取得發送請求前須等待的秒數：0為允許發送(暫停結束時由此請求試探)
+    # 試探請求進行中時，其他請求每隔至多1秒重新確認；試探請求超過reset_timeout未回報時，改由下一個請求試探
+    def __remaining(self, host):
+        with self.lock:
+            opened_at = self.opened_at.get(host)
+            if opened_at is None:
+                return 0
+            now = time.monotonic()
+            remaining = opened_at + self.reset_timeout - now
+            if remaining > 0:
+                return remaining
+            probe_started = self.probing.get(host)
+            if probe_started is not None and now - probe_started < self.reset_timeout:
+                return min(1, self.reset_timeout)
+            self.probing[host] = now
+            return 0
+
+    # 是否允許發送請求
+    def allow(self, host):
+        return self.__remaining(host) == 0
+
+    # 等待至允許發送請求：回傳True；等待超過max_wait秒仍未恢復時回傳False
+    async def wait(self, host):
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            remaining = self.__remaining(host)
+            if remaining == 0:
+                return True
+            now = time.monotonic()
+            if now >= deadline:
+                return False
+            await asyncio.sleep(min(remaining, deadline - now))
+
+    # 請求成功：清除連續失敗次數，並恢復請求
+    def record_success(self, host):
+        with self.lock:
+            self.failures[host] = 0
+            self.probing.pop(host, None)
+            if self.opened_at.pop(host, None) is not None:
+                CRAWLER_CIRCUIT_OPEN.set(0, host=host)
+
+    # 請求失敗：累計連續失敗次數，達到門檻或試探失敗時暫停請求
+    def record_failure(self, host):
+        with self.lock:
+            self.failures[host] = self.failures.get(host, 0) + 1
+            if self.failures[host] >= self.failure_threshold or host in self.probing:
+                self.opened_at[host] = time.monotonic()
+                self.probing.pop(host, None)
+                CRAWLER_CIRCUIT_OPEN.set(1, host=host)
+
+    # 取得各主機的熔斷狀態：回傳List of Dict
+    def stats(self):
+        with self.lock:
+            now = time.monotonic()
+            return [{
+                'host': host,
+                'failures': failures,
+                'open': host in self.opened_at,
+                'retry_in_seconds': round(max(self.opened_at[host] + self.reset_timeout - now, 0), 3)
+                if host in self.opened_at else None,
+            } for host, failures in self.failures.items()]
+
+
+class AsyncFetcher:
+    '''
+    非同步爬蟲：所有請求共用同一個連線池(保持連線)，並限制每個主機的同時請求數量；須以 async with 使用
+    '''
+
+    # per_host_limit：每個主機的同時請求數量；timeout：每次請求的逾時秒數
+    # rate_limiter：速率控制(AdaptiveRateLimiter)，每次發送請求前取得許可，並依回應結果調整速率
+    # circuit_breaker：熔斷器(CircuitBreaker)，主機連續失敗過多時暫停請求
+    def __init__(self, per_host_limit=4, max_connections=32, timeout=10, retry=None, rate_limiter=None,
+                 circuit_breaker=None) -> None:
+        self.per_host_limit = per_host_limit
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.retry = retry or RetryPolicy()
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.semaphores = {}  # 主機名稱 -> asyncio.Semaphore
+        self.client = None
+
+    async def __aenter__(self):
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections),
+            timeout=httpx.Timeout(self.timeout),
+            follow_redirects=True)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.client.aclose()
+        self.client = None
+
+    # 取得主機的同時請求限制
+    def __semaphore(self, host):
+        semaphore = self.semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_host_limit)
+            self.semaphores[host] = semaphore
+        return semaphore
+
+    # 回報限流或異常：由速率控制降低該主機的請求速率，並累計熔斷器的失敗次數
+    def __throttle(self, host, reason, retry_after=None):
+        if self.rate_limiter is not None:
+            self.rate_limiter.on_throttle(host, reason, retry_after)
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_failure(host)
+
+    # 發送請求：依重試策略重試，並記錄監控指標；validate為驗證回應內容的函式，回傳False時視為失敗並重試
+    # 回傳httpx.Response，重試用盡或不可重試的錯誤則拋出FetchError，主機熔斷超過等待上限則拋出CircuitOpenError
+    async def request(self, method, url, validate=None, **kwargs):
+        host = parse.urlsplit(url).hostname
+        semaphore = self.__semaphore(host)
+        reason = None
+
+        for attempt in range(self.retry.max_retries + 1):
+            if attempt > 0:
+                CRAWLER_RETRIES.inc(host=host)
+                await asyncio.sleep(self.retry.delay(attempt))
+
+            # 主機熔斷中：等待暫停結束(不佔用同時請求數量)，超過等待上限仍未恢復時放棄
+            if self.circuit_breaker is not None and not await self.circuit_breaker.wait(host):
+                raise CircuitOpenError(url, f'{host} 連續失敗過多，暫停請求逾 {self.circuit_breaker.max_wait} 秒')
+
+            async with semaphore:
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire(host)
+                try:
+                    response = await self.client.request(method, url, **kwargs)
+                except httpx.TransportError as e:
+                    CRAWLER_REQUESTS.inc(host=host, status='error')
+                    reason = f'{type(e).__name__} {e}'
+                    self.__throttle(host, 'timeout' if isinstance(e, httpx.TimeoutException) else 'error')
+                    continue
+
+            CRAWLER_REQUESTS.inc(host=host, status=response.status_code)
+            CRAWLER_BYTES.inc(len(response.content), host=host)
+
+            if response.status_code in self.retry.retry_statuses:
+                reason = f'HTTP {response.status_code}'
+                self.__throttle(host, response.status_code, parse_retry_after(response.headers.get('Retry-After')))
+                continue
+            if response.is_error:
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.record_success(host)  # 主機正常回應，錯誤屬於該請求本身
+                raise FetchError(url, f'HTTP {response.status_code}')
+            if validate is not None and not validate(response):
+                # 回應內容異常屬於該請求本身(例如單一測站的資料)，主機仍正常回應，重試但不降低速率
+                reason = '回應內容驗證失敗'
+                continue
+
+            if self.rate_limiter is not None:
+                self.rate_limiter.on_success(host)
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.record_success(host)
+            return response
+
+        raise FetchError(url, reason)
@@ -1,99 +1,430 @@
 import os
+import asyncio
 from tqdm import tqdm
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, event, text
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.dialects import sqlite
 from sqlalchemy.orm import Session, sessionmaker
 from .models import *
+from .rollups import refresh_rollups, rebuild_rollups, create_rollup_syntax
+from .prefixsums import refresh_prefix_sums, rebuild_prefix_sums, create_prefix_syntax
+from .slowlog import SlowQueryLog, format_query_plan
+from .crawler import AsyncFetcher, CircuitBreaker, FetchError
+from .ratelimit import AdaptiveRateLimiter, RateBudget
+from .planner import plan_requests, station_span, month_windows, missing_window
+from .metrics import SQL_SECONDS, SQL_ROWS, ETL_STAGE_SECONDS
 import time
-import random
-import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
-from urllib import parse
 from fake_useragent import UserAgent
 import configparser
 import datetime
+import threading
 import arrow
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from functools import partial
 
 
+# 批次寫入時每批的資料值數量(筆數 × 欄位數)
+UPSERT_BATCH_VALUES = 200000
+
+# 即時觀測時間序列的每小時彙整：欄位名稱與對應的SQL運算式(降雨量為當日累積值，取每小時最大值)
+REALTIME_HOURLY_COLUMNS = {
+    'samples': 'COUNT(*)',
+    'Precp': 'MAX(Precp)',
+    'Temperature': 'AVG(Temperature)',
+    'Tmax': 'MAX(Temperature)',
+    'Tmin': 'MIN(Temperature)',
+    'RH': 'AVG(RH)',
+    'WS': 'AVG(WS)',
+    'WSmax': 'MAX(WS)',
+    'UVI': 'MAX(UVI)',
+}
+
+# 歷史觀測資料的觀測項目欄位(history_compact 中主鍵以外的欄位)
+HISTORY_MEASURES = [column.name for column in HistoryCompact.__table__.columns if not column.primary_key]
+
+# 爬取失敗的測站月份(dead-letter)：之後的資料更新會重試，成功後刪除
+DEAD_LETTER_SYNTAX = """
+    CREATE TABLE IF NOT EXISTS "fetch_dead_letter" (
+        "sID"	TEXT, -- 測站代碼
+        "month"	TEXT, -- 資料月份(YYYY-MM)
+        "error"	TEXT, -- 最後一次的錯誤訊息
+        "attempts"	INTEGER, -- 累計失敗次數
+        "failed_at"	INTEGER, -- 最後一次失敗時間
+        PRIMARY KEY("sID","month")
+    ) WITHOUT ROWID;
+"""
+
+# 歷史資料回補的工作清單：每個測站月份一筆，寫入完成後標記為done，重新執行時略過
+BACKFILL_MANIFEST_SYNTAX = """
+    CREATE TABLE IF NOT EXISTS "backfill_manifest" (
+        "sID"	TEXT, -- 測站代碼
+        "month"	TEXT, -- 資料月份(YYYY-MM)
+        "status"	TEXT, -- pending、done或failed
+        "rows"	INTEGER, -- 寫入的資料筆數
+        "fetched_at"	INTEGER, -- 爬取時間
+        PRIMARY KEY("sID","month")
+    ) WITHOUT ROWID;
+"""
+
+
+class StreamLimitError(Exception):
+    '''
+    串流查詢數量已達上限
+    '''
+
+
 class SQLOperate:
     '''
     資料庫操作
     '''
 
-    def __init__(self) -> None:
+    # 資料版本：各資料表每次寫入成功後遞增，由所有SQLOperate實例共用，供API回應快取判斷資料是否異動
+    data_versions = {}
+    data_versions_lock = threading.Lock()
+
+    # 寫入鎖：同一程序內的所有寫入依序進行，避免寫入交易互相等待
+    write_lock = threading.Lock()
+
+    # 寫入後續處理：資料表名稱 -> List of 函式(connection, 暫存表名稱)，於upsert每批合併後、同一交易內執行
+    # 函式回傳其異動的衍生資料表名稱，寫入成功後一併遞增資料版本
+    write_hooks = {}
+
+    # 預設儲存設定：套用於每條連線的PRAGMA
+    DEFAULT_STORAGE_PROFILE = {
+        'journal_mode': 'WAL',  # 預寫式日誌：寫入時不阻擋讀取
+        'synchronous': 'NORMAL',  # WAL模式下兼顧安全與寫入速度
+        'mmap_size': 268435456,  # 記憶體映射讀取(256MB)
+        'cache_size': -65536,  # 每條連線的頁面快取(64MB，負數單位為KB)
+        'busy_timeout': 10000,  # 資料庫鎖定時的等待時間(毫秒)
+    }
+
+    # slow_query_threshold：慢查詢門檻(秒)，設定時記錄超過門檻的查詢與其查詢計畫；slow_query_entries：保留的紀錄筆數
+    # max_streams：同時進行的串流查詢數量上限，串流查詢使用獨立的連線池
+    def __init__(self, max_workers=4, storage_profile=None, slow_query_threshold=None, slow_query_entries=200,
+                 max_streams=4) -> None:
         DATABASE_URL = f"sqlite:///data/weather.db"
-        self.sqlite_engine = create_engine(DATABASE_URL)
+        self.storage_profile = {**self.DEFAULT_STORAGE_PROFILE, **(storage_profile or {})}
+
+        # 讀取連線池：大小與執行緒數量一致，讓每個工作執行緒都能取得獨立連線，連線設為唯讀
+        self.read_engine = create_engine(
+            DATABASE_URL,
+            poolclass=QueuePool,
+            pool_size=max_workers,
+            max_overflow=0,
+            connect_args={'check_same_thread': False})
+        event.listen(self.read_engine, 'connect',
+                     partial(self.__apply_storage_profile, read_only=True))
+
+        # 串流查詢連線池：串流回應期間持續佔用連線(受用戶端讀取速度影響)，與讀取連線池分開，避免其他查詢取不到連線
+        self.stream_engine = create_engine(
+            DATABASE_URL,
+            poolclass=QueuePool,
+            pool_size=max_streams,
+            max_overflow=0,
+            connect_args={'check_same_thread': False})
+        event.listen(self.stream_engine, 'connect',
+                     partial(self.__apply_storage_profile, read_only=True))
+        self.stream_slots = threading.BoundedSemaphore(max_streams)
+
+        # 慢查詢紀錄(選用)：記錄每條連線最後執行的SQL語法與參數，供查詢計畫分析
+        self.slow_query_log = None
+        if slow_query_threshold is not None:
+            self.slow_query_log = SlowQueryLog(slow_query_threshold, slow_query_entries)
+            event.listen(self.read_engine, 'before_cursor_execute', self.__remember_statement)
+            event.listen(self.stream_engine, 'before_cursor_execute', self.__remember_statement)
+
+        # 寫入連線：僅一條連線，供資料處理管線依序寫入
+        self.write_engine = create_engine(
+            DATABASE_URL,
+            poolclass=QueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=3600,
+            connect_args={'check_same_thread': False})
+        event.listen(self.write_engine, 'connect',
+                     partial(self.__apply_storage_profile, read_only=False))
+
+        # 資料庫專用執行緒池：供非同步API呼叫，避免阻塞事件迴圈
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='sql_operate')
+
+    # 套用儲存設定：每條新連線建立時執行PRAGMA；唯讀連線另外設定query_only
+    def __apply_storage_profile(self, dbapi_connection, connection_record, read_only):
+        cursor = dbapi_connection.cursor()
+        for key, value in self.storage_profile.items():
+            if value is not None:
+                cursor.execute(f'PRAGMA {key} = {value}')
+        if read_only:
+            cursor.execute('PRAGMA query_only = ON')
+        cursor.close()
+
+    # 記錄連線最後執行的SQL語法與參數(驅動程式層級，已展開expanding參數)
+    @staticmethod
+    def __remember_statement(conn, cursor, statement, parameters, context, executemany):
+        conn.info['last_statement'] = (statement, parameters)
+
+    # 讀取操作的監控：取得讀取連線，記錄執行時間與資料筆數；執行時間超過慢查詢門檻時，記錄SQL語法、參數與查詢計畫
+    # 產生 (連線, 紀錄)，紀錄的rows由呼叫端填入資料筆數
+    # engine省略時使用讀取連線池
+    @contextmanager
+    def __observe(self, operation, engine=None):
+        start = time.perf_counter()
+        with (engine or self.read_engine).connect() as connection:
+            wait_seconds = time.perf_counter() - start
+            record = {'rows': 0}
+            try:
+                yield connection, record
+            finally:
+                seconds = time.perf_counter() - start
+                SQL_SECONDS.observe(seconds, operation=operation)
+                SQL_ROWS.inc(record['rows'], operation=operation)
+                if self.slow_query_log is not None and seconds >= self.slow_query_log.threshold:
+                    self.__log_slow_query(operation, connection, record['rows'], seconds, wait_seconds)
+
+    # 記錄慢查詢：以同一條連線執行EXPLAIN QUERY PLAN；wait_seconds為等待取得連線的時間，用於判斷是否為連線池競爭
+    def __log_slow_query(self, operation, connection, rows, seconds, wait_seconds):
+        statement, parameters = connection.info.get('last_statement', (None, None))
+        if statement is None:
+            return
+
+        try:
+            plan = format_query_plan(connection.exec_driver_sql(
+                f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall())
+        except Exception as e:
+            plan = [f'查詢計畫取得失敗：{e}']
+
+        self.slow_query_log.record(
+            operation, ' '.join(statement.split()), list(parameters or []), rows,
+            seconds, plan, wait_seconds)
+
+    # 非同步執行：將同步的資料庫操作交由執行緒池處理
+    async def run_async(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    # 遞增資料表的資料版本
+    @classmethod
+    def bump_version(cls, tablename):
+        with cls.data_versions_lock:
+            cls.data_versions[tablename] = cls.data_versions.get(tablename, 0) + 1
+
+    # 取得多個資料表目前的資料版本：回傳 Tuple of (資料表名稱, 版本)
+    @classmethod
+    def get_versions(cls, tablenames):
+        with cls.data_versions_lock:
+            return tuple((tablename, cls.data_versions.get(tablename, 0)) for tablename in tablenames)
+
+    # 註冊寫入後續處理：tablename每批寫入後執行hook，用於維護彙整表等衍生資料
+    @classmethod
+    def register_write_hook(cls, tablename, hook):
+        cls.write_hooks.setdefault(tablename, []).append(hook)
+
+    # 轉換SQL語法：字串以text()包裝；已建構好的語法物件(例如含expanding參數)則直接使用
+    @staticmethod
+    def to_clause(syntax):
+        if isinstance(syntax, str):
+            return text(syntax)
+        return syntax
 
     # 查詢資料：輸入SQL語法、回傳List of Dict
     def query(self, syntax):
-        with Session(self.sqlite_engine) as session:
-            result = session.execute(text(syntax))
+        with self.__observe('query') as (connection, record):
+            result = connection.execute(self.to_clause(syntax))
             data = result.fetchall()
             column_names = result.keys()
 
             query_result = [dict(zip(column_names, row)) for row in data]
+            record['rows'] = len(query_result)
 
         return query_result
 
     # 查詢資料(API)：藉由已建構好的SQL語法，輸入查詢條件、回傳List of Dict
     def api_query(self, syntax, syntax_params_dict):
-        with Session(self.sqlite_engine) as session:
-            query_result = session.execute(text(syntax), syntax_params_dict)
+        with self.__observe('api_query') as (connection, record):
+            query_result = connection.execute(self.to_clause(syntax), syntax_params_dict)
             query_data = query_result.fetchall()
             query_column_names = query_result.keys()
 
             result = [dict(zip(query_column_names, row)) for row in query_data]
+            record['rows'] = len(result)
 
         return result
 
+    # 查詢資料(API)：輸入SQL語法與查詢條件、回傳欄位名稱與資料列(List of Tuple)，供列式格式輸出使用
+    # 資料列直接由資料庫游標取得(sqlite3回傳tuple)，不經過逐筆轉換；語法的欄位不可指定需轉換型別的類型
+    def api_query_rows(self, syntax, syntax_params_dict):
+        with self.__observe('api_query_rows') as (connection, record):
+            query_result = connection.execute(self.to_clause(syntax), syntax_params_dict)
+            query_column_names = list(query_result.keys())
+            query_data = query_result.cursor.fetchall()
+            query_result.close()
+            record['rows'] = len(query_data)
+
+        return query_column_names, query_data
+
+    # 資料表是否存在：以讀取連線查詢，不佔用寫入連線
+    def has_table(self, table_name):
+        return len(self.api_query("""
+            SELECT name FROM sqlite_master
+            WHERE type = 'table' AND name = :name
+        """, {'name': table_name})) != 0
+
+    # 逐批查詢資料(API)：輸入SQL語法與查詢條件，每次讀取chunk_size筆，逐批回傳List of Dict
+    # 使用串流查詢連線池；同時進行的串流查詢已達上限時，於取得第一批資料時拋出StreamLimitError
+    def iter_api_query(self, syntax, syntax_params_dict, chunk_size=1000):
+        if not self.stream_slots.acquire(blocking=False):
+            raise StreamLimitError('同時進行的串流查詢已達上限')
+
+        try:
+            with self.__observe('iter_api_query', self.stream_engine) as (connection, record):
+                query_result = connection.execution_options(stream_results=True).execute(
+                    self.to_clause(syntax), syntax_params_dict)
+                query_column_names = list(query_result.keys())
+
+                for rows in query_result.partitions(chunk_size):
+                    record['rows'] += len(rows)
+                    yield [dict(zip(query_column_names, row)) for row in rows]
+        finally:
+            self.stream_slots.release()
+
+    # 非同步查詢資料：輸入SQL語法、回傳List of Dict
+    async def async_query(self, syntax):
+        return await self.run_async(self.query, syntax)
+
+    # 非同步查詢資料(API)：輸入SQL語法與查詢條件、回傳List of Dict
+    async def async_api_query(self, syntax, syntax_params_dict):
+        return await self.run_async(self.api_query, syntax, syntax_params_dict)
+
+    # 非同步查詢資料(API)：輸入SQL語法與查詢條件、回傳欄位名稱與資料列
+    async def async_api_query_rows(self, syntax, syntax_params_dict):
+        return await self.run_async(self.api_query_rows, syntax, syntax_params_dict)
+
     # 建立表格
     def create_table(self, syntax):
-        with Session(self.sqlite_engine) as session:
+        with self.write_lock, Session(self.write_engine) as session:
             session.execute(text(syntax))
             session.commit()
             table_name = syntax.split('"')[1]
             print(f'資料表 {table_name} 建立成功！')
 
-    # 新增或更新資料：輸入要插入的表模型、待寫入資料(List of Dict)、批次寫入筆數
-    def upsert(self, table, data, batch_size=1000):
+    # 執行寫入：於寫入連線的單一交易內執行func(connection)，func回傳異動的資料表名稱，成功後遞增其資料版本
+    def execute_write(self, func):
+        with SQL_SECONDS.time(operation='execute_write'), self.write_lock, self.write_engine.connect() as connection:
+            with connection.begin():
+                tables = func(connection) or []
+
+        for tablename in tables:
+            self.bump_version(tablename)
+        return tables
+
+    # 重整資料庫檔案：釋放刪除資料後的空間，並依主鍵順序重新排列頁面
+    def vacuum(self):
+        with SQL_SECONDS.time(operation='vacuum'), self.write_lock, self.write_engine.connect() as connection:
+            connection.execution_options(isolation_level='AUTOCOMMIT').exec_driver_sql('VACUUM')
+
+    # 新增或更新資料：輸入要插入的表模型、待寫入資料(List of Dict)、批次寫入筆數(省略時依欄位數量決定)
+    # skip_unchanged為True時，與資料庫內容相同的資料不會更新
+    # 回傳各類筆數 {'inserted': 新增, 'updated': 更新, 'unchanged': 未變動}；寫入失敗時回傳None
+    def upsert(self, table, data, batch_size=None, skip_unchanged=True):
+        result = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        if len(data) == 0:
+            return result
+
         # 取得資料表名稱
         tablename = table.__tablename__
 
-        # 取得主鍵
+        # 取得主鍵與寫入欄位
         primary_key_columns = [
             column.name for column in table.__table__.columns if column.primary_key]
+        columns = list(data[0].keys())
+        update_columns = [column for column in columns if column not in primary_key_columns]
+
+        # 批次筆數：依欄位數量調整，使每批的資料值數量固定
+        if batch_size is None:
+            batch_size = max(UPSERT_BATCH_VALUES // len(columns), 1)
+
+        # 建構SQL語法：資料先寫入暫存表，再以單一語法合併至資料表
+        stage = f'"upsert_stage_{tablename}"'
+        column_list = ', '.join(f'"{column}"' for column in columns)
+        key_list = ', '.join(f'"{column}"' for column in primary_key_columns)
+        key_match = ' AND '.join(
+            f't."{column}" = s."{column}"' for column in primary_key_columns)
+        differ = ' OR '.join(
+            f't."{column}" IS NOT s."{column}"' for column in update_columns) or '0'
+
+        create_stage = f'CREATE TEMP TABLE IF NOT EXISTS {stage} ({column_list}, PRIMARY KEY ({key_list}))'
+        insert_stage = f'INSERT OR REPLACE INTO {stage} ({column_list}) VALUES ({", ".join("?" * len(columns))})'
+        count_inserted = f'SELECT COUNT(*) FROM {stage} s WHERE NOT EXISTS (SELECT 1 FROM "{tablename}" t WHERE {key_match})'
+        count_changed = f'SELECT COUNT(*) FROM {stage} s JOIN "{tablename}" t ON {key_match} WHERE {differ}'
+        if len(update_columns) != 0:
+            conflict_action = 'UPDATE SET ' + ', '.join(
+                f'"{column}" = excluded."{column}"' for column in update_columns)
+        else:
+            conflict_action = 'NOTHING'
+        merge = f'''
+            INSERT INTO "{tablename}" ({column_list})
+            SELECT {column_list} FROM {stage} WHERE true
+            ON CONFLICT ({key_list}) DO {conflict_action}
+        '''
+        if skip_unchanged and len(update_columns) != 0:
+            merge += ' WHERE ' + ' OR '.join(
+                f'"{tablename}"."{column}" IS NOT excluded."{column}"' for column in update_columns)
+
+        # 批次新增或更新資料，並執行寫入後續處理(僅於該批有新增或更新時)
+        hooks = self.write_hooks.get(tablename, [])
+        derived_tables = set()
+        with SQL_SECONDS.time(operation='upsert'), self.write_lock, self.write_engine.connect() as connection:
+            try:
+                with connection.begin():
+                    connection.exec_driver_sql(create_stage)
+                    connection.exec_driver_sql(f'DELETE FROM {stage}')
+
+                    for idx in range(0, len(data), batch_size):
+                        batch = [tuple(item[column] for column in columns)
+                                 for item in data[idx: idx + batch_size]]
+                        connection.exec_driver_sql(insert_stage, batch)
+
+                        staged = connection.exec_driver_sql(f'SELECT COUNT(*) FROM {stage}').scalar()
+                        inserted = connection.exec_driver_sql(count_inserted).scalar()
+                        changed = connection.exec_driver_sql(count_changed).scalar()
+                        connection.exec_driver_sql(merge)
+                        if not skip_unchanged or inserted + changed != 0:
+                            for hook in hooks:
+                                derived_tables.update(hook(connection, stage))
+                        connection.exec_driver_sql(f'DELETE FROM {stage}')
+
+                        result['inserted'] += inserted
+                        if skip_unchanged:
+                            result['updated'] += changed
+                            result['unchanged'] += staged - inserted - changed
+                        else:
+                            result['updated'] += staged - inserted
 
-        # 取得更新資料的欄位
-        set_dict = {}
-        for key in data[0].keys():
-            if key not in primary_key_columns:
-                set_dict[key] = getattr(sqlite.insert(table).excluded, key)
+            except Exception as e:
+                print(e)
+                return None
 
-        # 將資料分割為多個批次
-        batches = []
-        for idx in range(0, len(data), batch_size):
-            batch = data[idx: idx + batch_size]
-            batches.append(batch)
+            finally:
+                connection.exec_driver_sql(f'DROP TABLE IF EXISTS {stage}')
 
-        # 批次新增或更新資料
-        with Session(self.sqlite_engine) as session:
-            session.begin()
+        if result['inserted'] + result['updated'] != 0:
+            self.bump_version(tablename)
+        for derived_table in derived_tables:
+            self.bump_version(derived_table)
 
-            try:
-                for batch_data in tqdm(batches, desc=f'資料表 {tablename} 寫入進度'):
-                    insert_stmt = sqlite.insert(table).values(batch_data)
-                    on_conflict_stmt = insert_stmt.on_conflict_do_update(
-                        index_elements=primary_key_columns, set_=set_dict)
+        SQL_ROWS.inc(len(data), operation='upsert')
+        print(f'資料表 {tablename} 寫入完成：新增 {result["inserted"]} 筆、更新 {result["updated"]} 筆、未變動 {result["unchanged"]} 筆')
+        return result
 
-                    session.execute(on_conflict_stmt)
-                session.commit()
 
-            except Exception as e:
-                session.rollback()
-                print(e)
+# 歷史觀測資料寫入後續處理：暫存表以stn_key為鍵，先對應回測站代碼，再更新月、年彙整值與累計和
+def refresh_history_derived(connection, stage):
+    source = f'(SELECT k.sID, s.obs_date FROM {stage} s JOIN station_key k ON k.stn_key = s.stn_key)'
+    return refresh_rollups(connection, source) + refresh_prefix_sums(connection, source)
+
+
+SQLOperate.register_write_hook('history_compact', refresh_history_derived)
 
 
 class DataPipeline:
@@ -101,10 +432,31 @@ class DataPipeline:
     資料處理
     '''
 
-    def __init__(self) -> None:
+    # 預設的主機請求速率(每秒請求數)：CODIS歷史資料由約每秒一次起步，依回應逐步加速
+    DEFAULT_FETCH_BUDGETS = {
+        'codis.cwa.gov.tw': RateBudget(initial_rate=1.0, min_rate=0.1, max_rate=8.0, burst=2),
+        'opendata.cwa.gov.tw': RateBudget(initial_rate=2.0, min_rate=0.2, max_rate=10.0, burst=4),
+    }
+
+    # realtime_raw_days：即時觀測原始資料保留天數，較舊的資料彙整為每小時資料
+    # realtime_retention_days：即時觀測每小時彙整資料的保留天數
+    # fetch_concurrency：爬蟲對每個主機的同時請求數量；fetch_timeout：每次請求的逾時秒數
+    # fetch_budgets：各主機的請求速率設定 {主機名稱: RateBudget}，未指定的主機使用 DEFAULT_FETCH_BUDGETS
+    # dead_letter_max_attempts：爬取失敗的測站月份累計失敗達此次數後停止自動重試(parked)，僅可手動重試
+    def __init__(self, realtime_raw_days=2, realtime_retention_days=90, fetch_concurrency=4, fetch_timeout=10,
+                 fetch_budgets=None, dead_letter_max_attempts=5) -> None:
         self.sql_operate = SQLOperate()
-
-        self.sleep_times = 0  # 爬蟲速度控制切換
+        self.realtime_raw_days = realtime_raw_days
+        self.realtime_retention_days = realtime_retention_days
+        self.fetch_concurrency = fetch_concurrency
+        self.fetch_timeout = fetch_timeout
+        self.dead_letter_max_attempts = dead_letter_max_attempts
+
+        # 爬蟲速度控制：依伺服器回應調整各主機的請求速率，調整後的速率保留至下次資料更新
+        self.rate_limiter = AdaptiveRateLimiter(
+            budgets={**self.DEFAULT_FETCH_BUDGETS, **(fetch_budgets or {})})
+        # 熔斷器：主機連續失敗過多時暫停請求，請求等待至主機恢復；暫停超過10分鐘時，測站月份記錄為爬取失敗
+        self.circuit_breaker = CircuitBreaker()
 
         # 使用config讀取授權碼
         # config = configparser.ConfigParser()
@@ -114,30 +466,6 @@ class DataPipeline:
         self.cwa_authorization = os.environ.get(
             "CWA_AUTHORIZATION")
 
-        # 初始化連線物件
-        self.session = requests.Session()
-        retry = Retry(total=5, backoff_factor=3,
-                      allowed_methods=frozenset(['GET', 'POST']))
-        adapter = HTTPAdapter(max_retries=retry)
-        self.session.mount('http://', adapter)
-        self.session.mount('https://', adapter)
-        self.session.keep_alive = False
-
-    # 暫停
-    def __pause(self):
-
-        if self.sleep_times % 2 == 0:
-            t = random.uniform(2, 6)
-            time.sleep(t)
-        else:
-            t = random.uniform(0.01, 4)
-            time.sleep(t)
-
-        if self.sleep_times == 20:
-            self.sleep_times = 0
-
-        self.sleep_times += 1
-
     """
     # 多工處理：使用多線程處理資料
 
@@ -145,19 +473,26 @@ class DataPipeline:
     - task: 處理每個資料項目的函式
     - data: 要處理的資料列表
     - max_workers: 同時運行的最大執行緒數量
+    - job: 背景工作(可省略)，用於回報處理進度
 
     Returns:
     - 處理完成的結果列表
     """
 
     # 多工處理：使用多線程處理資料
-    def __multi_thread_task(self, task, data, max_workers=4, desc=None):
+    def __multi_thread_task(self, task, data, max_workers=4, desc=None, job=None):
+        if job is not None:
+            job.set_total(len(data))
+
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
             # 提交資料處理工作
             futures = [executor.submit(task, item) for item in data]
             # 使用tqdm追蹤進度
-            results = [future.result()
-                       for future in tqdm(futures, total=len(data), desc=desc)]
+            results = []
+            for future in tqdm(futures, total=len(data), desc=desc):
+                results.append(future.result())
+                if job is not None:
+                    job.advance()
 
         return results
 
@@ -171,26 +506,55 @@ class DataPipeline:
 
     #         return results
 
-    # 發送請求(GET方法)
-    def __web_requests_get(self, url, headers=None, params=None):
-
-        try:
-            self.__pause()
-            response = self.session.get(
-                url, headers=headers, params=params, timeout=5)
-        except:
-            self.__pause()
-            response = self.session.get(
-                url, headers=headers, params=params, timeout=5)
-        finally:
-            while response.status_code != requests.codes.ok:
-                self.__pause()
-                response = self.session.get(
-                    url, headers=headers, params=params, timeout=5)
-
-        self.session.close()
-
-        return response
+    # 建立非同步爬蟲：同一次資料更新的所有請求共用連線池
+    def __new_fetcher(self):
+        return AsyncFetcher(per_host_limit=self.fetch_concurrency, timeout=self.fetch_timeout,
+                            rate_limiter=self.rate_limiter, circuit_breaker=self.circuit_breaker)
+
+    # 發送單一請求：回傳httpx.Response，失敗時拋出FetchError
+    def __fetch_one(self, method, url, validate=None, **kwargs):
+        async def run():
+            async with self.__new_fetcher() as fetcher:
+                return await fetcher.request(method, url, validate=validate, **kwargs)
+
+        return asyncio.run(run())
+
+    # 非同步爬取多筆資料：fetch為協程函式(fetcher, item)，由固定數量的工作協程依序取出項目處理
+    # 同時處理的項目數量不超過連線池大小，項目數量再多也不會一次建立所有協程或累積未寫入的結果
+    # 回傳與data順序相同的結果列表；job為背景工作(可省略)，用於回報進度
+    def __fetch_all(self, fetch, data, desc=None, job=None):
+        if job is not None:
+            job.set_total(len(data))
+
+        async def run():
+            progress = tqdm(total=len(data), desc=desc)
+            items = enumerate(data)  # 各工作協程共用，依序取出下一個項目
+            results = [None] * len(data)
+
+            async def worker(fetcher):
+                for index, item in items:
+                    try:
+                        results[index] = await fetch(fetcher, item)
+                    finally:
+                        progress.update()
+                        if job is not None:
+                            job.advance()
+
+            async with self.__new_fetcher() as fetcher:
+                workers = [asyncio.ensure_future(worker(fetcher))
+                           for _ in range(min(fetcher.max_connections, len(data)))]
+                try:
+                    await asyncio.gather(*workers)
+                finally:
+                    # 任一項目失敗時停止其餘工作協程，再關閉連線池
+                    for task in workers:
+                        task.cancel()
+                    await asyncio.gather(*workers, return_exceptions=True)
+                    progress.close()
+
+            return results
+
+        return asyncio.run(run())
 
     # 建立觀測站清單
     def build_station_list(self):
@@ -236,44 +600,48 @@ class DataPipeline:
         }
 
         # 爬取資料
-        response = self.__web_requests_get(url, headers=headers)
-        data = response.json()['data'][2]['item']
-
-        station_list = []
-
-        for item in data:
-            if '雷達' not in item['stationName'] and len(item['address']) != 0:
-
-                # 整理備註，若未填寫備註，則為None
-                if len(item['webRemark']) != 0:
-                    remark = item['webRemark']
-                else:
-                    remark = None
-
-                # 整理撤站日期，若未撤站，則為撤站日期為None、state為1
-                if len(item['stationEndDate']) == 0:
-                    end_date = None
-                    state = 1
-                else:
-                    end_date = item['stationEndDate']
-                    state = 0
-
-                station_list.append({
-                    'sID': item['stationID'],
-                    'stn_name': item['stationName'],
-                    'alt': item['altitude'],
-                    'lon': item['longitude'],
-                    'lat': item['latitude'],
-                    'county': item['countryName'],
-                    'addr': item['address'],
-                    'start_date': item['stationStartDate'],
-                    'end_date': end_date,
-                    'remark': remark,
-                    'state': state
-                })
+        with ETL_STAGE_SECONDS.time(task='station_list', stage='fetch'):
+            response = self.__fetch_one('GET', url, headers=headers)
+            data = response.json()['data'][2]['item']
+
+        # 整理資料
+        with ETL_STAGE_SECONDS.time(task='station_list', stage='transform'):
+            station_list = []
+
+            for item in data:
+                if '雷達' not in item['stationName'] and len(item['address']) != 0:
+
+                    # 整理備註，若未填寫備註，則為None
+                    if len(item['webRemark']) != 0:
+                        remark = item['webRemark']
+                    else:
+                        remark = None
+
+                    # 整理撤站日期，若未撤站，則為撤站日期為None、state為1
+                    if len(item['stationEndDate']) == 0:
+                        end_date = None
+                        state = 1
+                    else:
+                        end_date = item['stationEndDate']
+                        state = 0
+
+                    station_list.append({
+                        'sID': item['stationID'],
+                        'stn_name': item['stationName'],
+                        'alt': item['altitude'],
+                        'lon': item['longitude'],
+                        'lat': item['latitude'],
+                        'county': item['countryName'],
+                        'addr': item['address'],
+                        'start_date': item['stationStartDate'],
+                        'end_date': end_date,
+                        'remark': remark,
+                        'state': state
+                    })
 
         # 寫入資料庫
-        self.sql_operate.upsert(StationList, station_list)
+        with ETL_STAGE_SECONDS.time(task='station_list', stage='write'):
+            self.sql_operate.upsert(StationList, station_list)
 
     # 建立即時觀測資料表
     def build_realtime_obs_table(self):
@@ -293,8 +661,54 @@ class DataPipeline:
         """
         self.sql_operate.create_table(syntax)
 
-    # 爬取、並整理和寫入即時觀測資料
-    def etl_realtime_obs(self):
+        # 即時觀測時間序列：保留每次更新的觀測值，同一測站的資料依時間連續存放
+        syntax = """
+            CREATE TABLE IF NOT EXISTS "realtime_series" (
+                "sID"	TEXT, -- 測站代碼
+                "obs_time"	INTEGER, -- 時間
+                "Precp"	REAL, -- 降雨量
+                "WD"	REAL, -- 風向
+                "WS"	REAL, -- 風速
+                "Temperature"	REAL, -- 氣溫
+                "RH"	INTEGER, -- 相對溼度
+                "UVI"	REAL, -- 紫外線
+                PRIMARY KEY("sID","obs_time")
+            ) WITHOUT ROWID;
+        """
+        self.sql_operate.create_table(syntax)
+
+        # 時間索引：彙整與刪除過期資料時依時間範圍定位，不需掃描整張資料表
+        syntax = """
+            CREATE INDEX IF NOT EXISTS "realtime_series_time" ON "realtime_series" ("obs_time");
+        """
+        self.sql_operate.create_table(syntax)
+
+        # 即時觀測每小時彙整：原始資料超過保留天數後彙整至此
+        syntax = """
+            CREATE TABLE IF NOT EXISTS "realtime_hourly" (
+                "sID"	TEXT, -- 測站代碼
+                "obs_time"	INTEGER, -- 整點時間(該小時的起始時間)
+                "samples"	INTEGER, -- 原始資料筆數
+                "Precp"	REAL, -- 當日累積降雨量
+                "Temperature"	REAL, -- 平均氣溫
+                "Tmax"	REAL, -- 最高氣溫
+                "Tmin"	REAL, -- 最低氣溫
+                "RH"	REAL, -- 平均相對溼度
+                "WS"	REAL, -- 平均風速
+                "WSmax"	REAL, -- 最大風速
+                "UVI"	REAL, -- 最大紫外線
+                PRIMARY KEY("sID","obs_time")
+            ) WITHOUT ROWID;
+        """
+        self.sql_operate.create_table(syntax)
+
+        syntax = """
+            CREATE INDEX IF NOT EXISTS "realtime_hourly_time" ON "realtime_hourly" ("obs_time");
+        """
+        self.sql_operate.create_table(syntax)
+
+    # 爬取、並整理和寫入即時觀測資料：job為背景工作(可省略)，用於回報進度與寫入筆數
+    def etl_realtime_obs(self, job=None):
 
         # 查詢現存測站代號
         syntax = """
@@ -320,9 +734,10 @@ class DataPipeline:
 
         # 爬取資料
         url = 'https://opendata.cwa.gov.tw/api/v1/rest/datastore/O-A0003-001'
-        response = self.__web_requests_get(url, params=params)
+        with ETL_STAGE_SECONDS.time(task='realtime', stage='fetch'):
+            response = self.__fetch_one('GET', url, params=params)
 
-        data = response.json()['records']['Station']
+            data = response.json()['records']['Station']
 
         # 轉換並整理資料
         def transform_realtime_obs(item):
@@ -358,18 +773,92 @@ class DataPipeline:
                 'UVI': uvi
             }
         # 使用多線程處理資料
-        process_result = self.__multi_thread_task(
-            transform_realtime_obs, data, desc='資料整理進度')
-
-        # 寫入資料庫
-        self.sql_operate.upsert(DataRealtime, process_result)
-
-    # 建立歷史觀測資料表
+        with ETL_STAGE_SECONDS.time(task='realtime', stage='transform'):
+            process_result = self.__multi_thread_task(
+                transform_realtime_obs, data, desc='資料整理進度', job=job)
+
+        # 寫入資料庫：data_realtime 保留各測站最新一筆，realtime_series 另外累積時間序列
+        # 停止更新的測站會持續回傳舊的觀測時間，早於原始資料保留期間的資料已彙整，不再寫入時間序列
+        raw_cutoff = self.__raw_cutoff(time.time())
+        with ETL_STAGE_SECONDS.time(task='realtime', stage='write'):
+            result = self.sql_operate.upsert(DataRealtime, process_result)
+            series = [{key: value for key, value in item.items() if key != 'stn_name'}
+                      for item in process_result if item['obs_time'] >= raw_cutoff]
+            self.sql_operate.upsert(RealtimeSeries, series)
+        self.__report_written(job, result, len(process_result))
+
+        # 彙整與清除過期的時間序列
+        with ETL_STAGE_SECONDS.time(task='realtime', stage='compact'):
+            self.compact_realtime_series()
+
+    # 彙整即時觀測時間序列：超過原始資料保留天數的資料依整點彙整至 realtime_hourly 後刪除，
+    # 並刪除超過彙整資料保留天數的每小時資料；now可指定目前時間(時間戳)
+    def compact_realtime_series(self, now=None):
+        now = int(time.time() if now is None else now)
+        raw_cutoff = self.__raw_cutoff(now)
+        retention_cutoff = now - self.realtime_retention_days * 86400
+
+        columns = ', '.join(REALTIME_HOURLY_COLUMNS)
+        expressions = ', '.join(REALTIME_HOURLY_COLUMNS.values())
+
+        def compact(connection):
+            # 已彙整的小時不重新彙整：僅剩少數補寫的資料時，會以部分資料覆蓋完整的彙整結果
+            compacted = connection.exec_driver_sql(f"""
+                INSERT INTO realtime_hourly (sID, obs_time, {columns})
+                SELECT sID, obs_time / 3600 * 3600 AS hour, {expressions}
+                FROM realtime_series s
+                WHERE obs_time < ?
+                AND NOT EXISTS (
+                    SELECT 1 FROM realtime_hourly h
+                    WHERE h.sID = s.sID AND h.obs_time = s.obs_time / 3600 * 3600
+                )
+                GROUP BY sID, hour
+            """, (raw_cutoff,)).rowcount
+            removed = connection.exec_driver_sql(
+                'DELETE FROM realtime_series WHERE obs_time < ?', (raw_cutoff,)).rowcount
+            expired = connection.exec_driver_sql(
+                'DELETE FROM realtime_hourly WHERE obs_time < ?', (retention_cutoff,)).rowcount
+
+            tables = []
+            if removed > 0:
+                tables += ['realtime_series']
+            if compacted > 0 or expired > 0:
+                tables += ['realtime_hourly']
+            return tables
+
+        return self.sql_operate.execute_write(compact)
+
+    # 原始資料保留期間的起點：以整點切分，避免同一小時的資料分成兩次彙整
+    def __raw_cutoff(self, now):
+        return (int(now) - self.realtime_raw_days * 86400) // 3600 * 3600
+
+    # 回報寫入結果：寫入筆數僅計新增與更新，未變動的筆數另外記錄；兩者合計少於待寫入筆數時記錄錯誤
+    def __report_written(self, job, result, expected):
+        if job is None:
+            return
+        written = 0 if result is None else result['inserted'] + result['updated']
+        unchanged = 0 if result is None else result['unchanged']
+        job.add_rows(written, unchanged)
+        if written + unchanged < expected:
+            job.add_error(f'資料寫入失敗：預計寫入 {expected} 筆，實際寫入 {written} 筆、未變動 {unchanged} 筆')
+
+    # 建立歷史觀測資料表：資料存放於 history_compact，data_history 為對應測站代碼與名稱的檢視表
+    # 若資料庫仍為舊版的 data_history 資料表，則先轉換至新格式
     def build_historical_obs_table(self):
+        # 測站整數鍵：取代事實表中重複的TEXT測站代碼
         syntax = """
-            CREATE TABLE IF NOT EXISTS "data_history" (
-                "sID"	TEXT, -- 測站代碼
-                "stn_name"	TEXT, -- 測站名稱
+            CREATE TABLE IF NOT EXISTS "station_key" (
+                "stn_key"	INTEGER, -- 測站整數鍵
+                "sID"	TEXT NOT NULL UNIQUE, -- 測站代碼
+                PRIMARY KEY("stn_key")
+            );
+        """
+        self.sql_operate.create_table(syntax)
+
+        # 歷史觀測資料：不含測站名稱，以(stn_key, obs_date)為叢集主鍵(WITHOUT ROWID)，同一測站的資料連續存放
+        syntax = """
+            CREATE TABLE IF NOT EXISTS "history_compact" (
+                "stn_key"	INTEGER, -- 測站整數鍵
                 "obs_date"	INTEGER, -- 資料日期
                 "StnPres"	REAL, -- 測站氣壓
                 "SeaPres"	REAL, -- 海平面氣壓
@@ -382,269 +871,635 @@ class DataPipeline:
                 "WSmax"	REAL, -- 最大風速
                 "WDmax"	INTEGER, -- 最大風向
                 "Precp"	REAL, -- 降雨量
-                "PrecpHour"	REAL, -- 降雨時數 
+                "PrecpHour"	REAL, -- 降雨時數
                 "SunShineHour"	REAL, -- 日照時數
                 "SunshineRate"	REAL, -- 日照率
                 "GloblRad"	REAL, -- 全天空日射量
                 "VisbMean"	REAL, -- 能見度
                 "UVImax"	REAL, -- 最大紫外線
                 "CloudAmount"	REAL, -- 總雲量
-                PRIMARY KEY("sID","obs_date")
-            );
+                PRIMARY KEY("stn_key","obs_date")
+            ) WITHOUT ROWID;
         """
         self.sql_operate.create_table(syntax)
 
-    # 爬取、並整理和寫入所有測站歷史觀測資料
-    def etl_historical_obs(self, start_date, end_date):
-        # 撈取觀測站清單
-        # syntax = """SELECT sID, stn_name FROM station_list"""
+        legacy = self.sql_operate.query("""
+            SELECT name FROM sqlite_master
+            WHERE type = 'table' AND name = 'data_history'
+        """)
+        if len(legacy) != 0:
+            self.migrate_historical_obs_table()
+
+        # 日期索引：查詢單日所有測站時依日期定位，再以叢集主鍵逐站讀取
         syntax = """
-            SELECT sID, stn_name
-            FROM station_list
-            WHERE state = 1
+            CREATE INDEX IF NOT EXISTS "history_compact_date" ON "history_compact" ("obs_date", "stn_key");
         """
-        station_list = self.sql_operate.query(syntax)
+        self.sql_operate.create_table(syntax)
 
-        # 建立觀測站代碼轉換表
-        station_list_code = {}
-        for item in station_list:
-            station_list_code[item['sID']] = item['stn_name']
-
-        # 建構爬蟲所需的標頭與負載訊息
-        def requests_params(item, st, et):
-            cm = st.floor("month")  # 取得資料起始月份
-            st = str(st.floor("day")).replace("+08:00", "")  # 轉換時間格式
-            et = str(et.floor("day")).replace("+08:00", "")  # 轉換時間格式
-
-            # 建構表單資料
-            payload = {
-                'date': str(cm),
-                'type': 'report_month',
-                'stn_ID': item['sID'],
-                'stn_type': 'cwb',
-                # 'more': None,
-                'start': st,
-                'end': et
-                # 'item': None
-            }
-            # 將表單資料轉換為URL編碼的字節串
-            data = parse.urlencode(payload).encode('utf-8')
-            # 計算Content-Length
-            content_length = len(data)
-
-            # 建構標頭
-            useragent = UserAgent().random
-            headers = {
-                'Accept': 'application/json, text/javascript, */*; q=0.01',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Accept-Language': 'zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7',
-                'Connection': 'keep-alive',
-                'Content-Length': str(content_length),
-                'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
-                'Dnt': '1',
-                'Host': 'codis.cwa.gov.tw',
-                'Origin': 'https://codis.cwa.gov.tw',
-                'Referer': 'https://codis.cwa.gov.tw/StationData',
-                'Sec-Ch-Ua': '"Not A(Brand";v="99", "Google Chrome";v="121", "Chromium";v="121"',
-                'Sec-Ch-Ua-Mobile': '?0',
-                'Sec-Ch-Ua-Platform': '"Windows"',
-                'Sec-Fetch-Dest': 'empty',
-                'Sec-Fetch-Mode': 'cors',
-                'Sec-Fetch-Site': 'same-origin',
-                'User-Agent': useragent,
-                'X-Requested-With': 'XMLHttpRequest'
-            }
+        # 檢視表：欄位與舊版 data_history 相同，查詢語法不需修改
+        measures = ', '.join(f'h."{column}"' for column in HISTORY_MEASURES)
+        syntax = f"""
+            CREATE VIEW IF NOT EXISTS "data_history" AS
+            SELECT k.sID, s.stn_name, h.obs_date, {measures}
+            FROM history_compact h
+            JOIN station_key k ON k.stn_key = h.stn_key
+            LEFT JOIN station_list s ON s.sID = k.sID;
+        """
+        self.sql_operate.create_table(syntax)
 
-            return (headers, payload, item['stn_name'])
+    # 配置測站整數鍵：尚未配置的測站代碼依序新增，並將 {測站代碼: 整數鍵} 寫入station_keys
+    def __assign_station_keys(self, sids, station_keys, connection):
+        inserted = connection.exec_driver_sql(
+            'INSERT OR IGNORE INTO station_key (sID) VALUES (?)', [(sid,) for sid in sids]).rowcount
+        for sid, stn_key in connection.exec_driver_sql('SELECT sID, stn_key FROM station_key'):
+            station_keys[sid] = stn_key
+
+        return ['station_key'] if inserted > 0 else []
+
+    # 寫入歷史觀測資料：輸入與 data_history 欄位相同的資料(List of Dict)，轉換為測站整數鍵後寫入 history_compact
+    # skip_unchanged與回傳值同 SQLOperate.upsert
+    def write_historical_obs(self, data, skip_unchanged=True):
+        if len(data) == 0:
+            return self.sql_operate.upsert(HistoryCompact, data, skip_unchanged=skip_unchanged)
+
+        station_keys = {}
+        sids = sorted({item['sID'] for item in data})
+        self.sql_operate.execute_write(
+            partial(self.__assign_station_keys, sids, station_keys))
+
+        compact = [{'stn_key': station_keys[item['sID']], 'obs_date': item['obs_date'],
+                    **{column: item[column] for column in HISTORY_MEASURES}} for item in data]
+        compact.sort(key=lambda item: (item['stn_key'], item['obs_date']))
+
+        result = self.sql_operate.upsert(HistoryCompact, compact, skip_unchanged=skip_unchanged)
+        if result is not None and result['inserted'] + result['updated'] != 0:
+            SQLOperate.bump_version('data_history')
+        return result
 
-        # 發送請求(POST方法)
-        def web_requests_post(item):
-            headers = item[0]  # 帶入標頭
-            payload = item[1]  # 帶入負載訊息
-            stn_name = item[2]  # 取得觀測站站名
+    # 轉換舊版歷史觀測資料表：依測站代碼配置整數鍵，依主鍵順序複製至 history_compact，刪除舊表後重整資料庫檔案
+    def migrate_historical_obs_table(self):
+        columns = ', '.join(f'"{column}"' for column in HISTORY_MEASURES)
+        measures = ', '.join(f'h."{column}"' for column in HISTORY_MEASURES)
+
+        def migrate(connection):
+            connection.exec_driver_sql("""
+                INSERT OR IGNORE INTO station_key (sID)
+                SELECT DISTINCT sID FROM data_history ORDER BY sID
+            """)
+            connection.exec_driver_sql(f"""
+                INSERT OR REPLACE INTO history_compact (stn_key, obs_date, {columns})
+                SELECT k.stn_key, h.obs_date, {measures}
+                FROM data_history h
+                JOIN station_key k ON k.sID = h.sID
+                ORDER BY k.stn_key, h.obs_date
+            """)
+            connection.exec_driver_sql('DROP TABLE data_history')
+            return ['station_key', 'history_compact', 'data_history']
+
+        self.sql_operate.execute_write(migrate)
+        self.sql_operate.vacuum()
+        print('資料表 data_history 已轉換為 history_compact')
+
+    # 建立月、年彙整表，並由現有的歷史觀測資料重建彙整值；之後由寫入後續處理增量更新
+    def build_rollup_tables(self):
+        self.sql_operate.create_table(create_rollup_syntax('month'))
+        self.sql_operate.create_table(create_rollup_syntax('year'))
+        self.sql_operate.execute_write(rebuild_rollups)
+
+    # 建立累計和資料表，並由現有的歷史觀測資料重建累計值；之後由寫入後續處理增量更新
+    def build_prefix_sum_table(self):
+        self.sql_operate.create_table(create_prefix_syntax())
+        self.sql_operate.execute_write(rebuild_prefix_sums)
+
+    # 建立爬取失敗紀錄表
+    def build_dead_letter_table(self):
+        self.sql_operate.create_table(DEAD_LETTER_SYNTAX)
+
+    # 更新爬取失敗紀錄：failures為 {測站代碼: 錯誤訊息}，累計失敗次數；succeeded為爬取成功的測站代碼，刪除其紀錄
+    def __update_dead_letters(self, month, failures, succeeded):
+        def write(connection):
+            connection.exec_driver_sql(DEAD_LETTER_SYNTAX)
+            if len(failures) > 0:
+                connection.execute(text("""
+                    INSERT INTO fetch_dead_letter (sID, month, error, attempts, failed_at)
+                    VALUES (:sID, :month, :error, 1, :failed_at)
+                    ON CONFLICT (sID, month) DO UPDATE
+                    SET error = excluded.error, attempts = attempts + 1, failed_at = excluded.failed_at
+                """), [{'sID': sid, 'month': month, 'error': error, 'failed_at': int(time.time())}
+                      for sid, error in failures.items()])
+            if len(succeeded) > 0:
+                connection.execute(text("""
+                    DELETE FROM fetch_dead_letter
+                    WHERE month = :month AND sID IN :stns
+                """).bindparams(bindparam('stns', expanding=True)), {'month': month, 'stns': list(succeeded)})
+            return ['fetch_dead_letter']
+
+        self.sql_operate.execute_write(write)
+
+    # 取得爬取失敗紀錄：before為月份(YYYY-MM，可省略)，僅取得較早的月份
+    # parked為累計失敗次數已達 dead_letter_max_attempts，不再自動重試
+    # 尚未建立紀錄表(未曾爬取失敗)時回傳空列表
+    def list_dead_letters(self, before=None):
+        if not self.sql_operate.has_table('fetch_dead_letter'):
+            return []
+        data = self.sql_operate.api_query("""
+            SELECT sID, month, error, attempts, failed_at, attempts >= :max_attempts AS parked
+            FROM fetch_dead_letter
+            WHERE :before IS NULL OR month < :before
+            ORDER BY month, sID
+        """, {'before': before, 'max_attempts': self.dead_letter_max_attempts})
+        for item in data:
+            item['parked'] = bool(item['parked'])
+        return data
+
+    # 重試爬取失敗的測站月份：依月份分批，只爬取失敗的測站；before為月份(YYYY-MM，可省略)，僅重試較早的月份
+    # include_parked為False時略過已停止自動重試的紀錄(parked)
+    def retry_dead_letters(self, job=None, before=None, include_parked=False):
+        months = {}
+        for item in self.list_dead_letters(before):
+            if item['parked'] and not include_parked:
+                continue
+            months.setdefault(item['month'], []).append(item['sID'])
+
+        today = arrow.now().floor('day')
+        for month, stations in months.items():
+            st = arrow.get(month, 'YYYY-MM', tzinfo='local')
+            et = min(st.ceil('month').floor('day'), today)
+            self.etl_historical_obs(st, et, job=job, stations=stations)
+
+    # 建構爬蟲所需的標頭與負載訊息
+    def __historical_params(self, item, st, et):
+        cm = st.floor("month")  # 取得資料起始月份
+        st = str(st.floor("day")).replace("+08:00", "")  # 轉換時間格式
+        et = str(et.floor("day")).replace("+08:00", "")  # 轉換時間格式
+
+        # 建構表單資料
+        payload = {
+            'date': str(cm),
+            'type': 'report_month',
+            'stn_ID': item['sID'],
+            'stn_type': 'cwb',
+            # 'more': None,
+            'start': st,
+            'end': et
+            # 'item': None
+        }
 
-            url = f'https://codis.cwa.gov.tw/api/station?'
+        # 建構標頭
+        useragent = UserAgent().random
+        headers = {
+            'Accept': 'application/json, text/javascript, */*; q=0.01',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'Accept-Language': 'zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7',
+            'Connection': 'keep-alive',
+            'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
+            'Dnt': '1',
+            'Host': 'codis.cwa.gov.tw',
+            'Origin': 'https://codis.cwa.gov.tw',
+            'Referer': 'https://codis.cwa.gov.tw/StationData',
+            'Sec-Ch-Ua': '"Not A(Brand";v="99", "Google Chrome";v="121", "Chromium";v="121"',
+            'Sec-Ch-Ua-Mobile': '?0',
+            'Sec-Ch-Ua-Platform': '"Windows"',
+            'Sec-Fetch-Dest': 'empty',
+            'Sec-Fetch-Mode': 'cors',
+            'Sec-Fetch-Site': 'same-origin',
+            'User-Agent': useragent,
+            'X-Requested-With': 'XMLHttpRequest'
+        }
 
-            try:
-                self.__pause()
-                response = self.session.post(
-                    url, headers=headers, data=payload, timeout=5)
+        return (headers, payload, item['stn_name'])
 
-            except:
-                self.__pause()
-                response = self.session.post(
-                    url, headers=headers, data=payload, timeout=5)
+    # 驗證回應內容：CODIS的回應內容另有狀態碼，與HTTP狀態碼一致時才是有效資料
+    @staticmethod
+    def __validate_codis(response):
+        try:
+            return response.status_code == response.json()['code']
+        except Exception:
+            return False
 
-            finally:
-                if 'response' in locals():
-                    while response.status_code != response.json()['code']:
-                        self.__pause()
-                        response = self.session.post(
-                            url, headers=headers, data=payload, timeout=5)
-                else:
-                    self.__pause()
-                    response = self.session.post(
-                        url, headers=headers, data=payload, timeout=5)
-                    while response.status_code != response.json()['code']:
-                        self.__pause()
-                        response = self.session.post(
-                            url, headers=headers, data=payload, timeout=5)
+    # 發送請求(POST方法)：Content-Length由httpx依表單內容計算；回應無資料時回傳None
+    # 爬取或解析失敗時記錄於failures {(測站代碼, 月份): 錯誤訊息}並回傳None
+    async def __fetch_historical(self, fetcher, item, failures=None, job=None):
+        headers = item[0]  # 帶入標頭
+        payload = item[1]  # 帶入負載訊息
+        stn_name = item[2]  # 取得觀測站站名
 
-            self.session.close()
+        url = f'https://codis.cwa.gov.tw/api/station?'
 
-            try:
-                data = response.json()['data'][0]
-                data['stn_name'] = stn_name  # 將觀測站站名加入資料中
-            except:
-                data = None
+        def fail(reason, message):
+            if failures is not None:
+                failures[(payload['stn_ID'], payload['date'][:7])] = reason
+            if job is not None:
+                job.add_error(f'{stn_name}({payload["stn_ID"]}) {message}')
 
-            return data
+        try:
+            response = await fetcher.request(
+                'POST', url, validate=self.__validate_codis, headers=headers, data=payload)
+        except FetchError as e:
+            fail(e.reason, e)
+            return None
 
-        # 轉換並整理資料
-        def transform_historical_obs(item):
-            histroy_obs = []
-            stn_id = item['StationID']  # 觀測站代碼
-            stn_name = item['stn_name']  # 觀測站名稱
-            data = item['dts']
-
-            for piece in data:
-
-                # 轉換觀測日期格式
-                obs_date = datetime.datetime.strptime(
-                    piece['DataDate'], "%Y-%m-%dT%H:%M:%S").timestamp()
-                obs_date = int(obs_date)
-
-                # 整理氣壓相關資料：測站未提供此資料，則為None；儀器故障的部分改為None
-                stn_pres = piece['StationPressure']['Mean']  # 測站氣壓
-                sea_pres = piece['SeaLevelPressure']['Mean']  # 海平面氣壓
-                if stn_pres == None or stn_pres < 0:
-                    stn_pres = None
-                if sea_pres == None or sea_pres < 0:
-                    sea_pres = None
-
-                # 整理相對濕度資料：測站未提供此資料，則為None；儀器故障的部分改為None
-                rh = piece['RelativeHumidity']['Mean']
-                if rh == None or rh < 0:
-                    rh = None
-
-                # 整理氣溫相關資料：測站未提供此資料，則為None；儀器故障的部分改為None
-                temperature = piece['AirTemperature']['Mean']  # 單日平均氣溫
-                t_max = piece['AirTemperature']['Maximum']  # 單日最高氣溫
-                t_min = piece['AirTemperature']['Minimum']  # 單日最低氣溫
-                if temperature == None or temperature == -99.5:
-                    temperature = None
-                if t_max == None or t_max == -99.5:
-                    t_max = None
-                if t_max == None or t_min == -99.5:
-                    t_min = None
-
-                # 整理風速相關資料：測站未提供此資料，則為None；儀器故障的部分改為None；風向未定則轉換為0
-                ws = piece['WindSpeed']['Mean']  # 風速
-                wd = piece['WindDirection']['Prevailing']  # 風向
-                ws_max = piece['PeakGust']['Maximum']  # 最大瞬間風速
-                wd_max = piece['PeakGust']['Direction']  # 最大瞬間風向
-                if ws == None or ws < 0:
-                    ws = None
-                if wd == None or wd < 0:
-                    wd = None
-                elif wd > 360:
-                    wd = 0
-                if ws_max == None or ws_max < 0:
-                    ws_max = None
-                if wd_max == None or wd_max < 0:
-                    wd_max = None
-                elif wd_max > 360:
-                    wd_max = 0
-
-                # 降雨量：測站未提供此資料，則為None；儀器故障的部分改為None；轉換雨跡
-                rainfall = piece['Precipitation']['Accumulation']  # 當日降雨量
-                if rainfall != None:
-                    if rainfall == -9.8:
-                        rainfall = 0.05
-                    elif rainfall < 0:
-                        rainfall = None
-                # 降雨時數：測站未提供此資料，則為None；儀器故障的部分改為None
-                rainfall_length = piece['PrecipitationDuration']['Total']
-                if rainfall_length == None or rainfall_length < 0:
-                    rainfall_length = None
-
-                # 整理日照資料：測站未提供此資料，則為None；儀器故障的部分改為None
-                sunshine_hour = piece['SunshineDuration']['Total']  # 日照時數
-                sunshine_rate = piece['SunshineDuration']['Rate']  # 日照率
-                if sunshine_hour == None or sunshine_hour < 0:
-                    sunshine_hour = None
-                if sunshine_rate == None or sunshine_rate < 0:
-                    sunshine_rate = None
-                # 全天空日射量：測站未提供此資料，則為None；儀器故障的部分改為None
-                globl_rad = piece['GlobalSolarRadiation']['Accumulation']
-                if globl_rad == None or globl_rad < 0:
-                    globl_rad = None
-
-                # 整理最大紫外線資料：測站未提供此資料，則為None；儀器故障的部分改為None
-                uvi_max = piece['UVIndex']['Maximum']
-                if uvi_max == None or uvi_max < 0:
-                    uvi_max = None
-
-                # 整理總雲量資料：因濃霧無法觀察，定義為11
-                cloud_amount = piece['TotalCloudAmount']['Mean']
-                if cloud_amount == None:
-                    cloud_amount == None
-                elif cloud_amount < 0:
-                    cloud_amount = 11
-
-                histroy_obs.append({
-                    'sID': stn_id,
-                    'stn_name': stn_name,
-                    'obs_date': obs_date,
-                    'StnPres': stn_pres,  # 測站氣壓
-                    'SeaPres': sea_pres,  # 海平面氣壓
-                    'Temperature': temperature,  # 氣溫
-                    'Tmax': t_max,  # 最高氣溫
-                    'Tmin': t_min,  # 最低氣溫
-                    'RH': rh,  # 相對溼度
-                    'WS': ws,  # 風速
-                    'WD': wd,  # 風向
-                    'WSmax': ws_max,  # 最大瞬間風速
-                    'WDmax': wd_max,  # 最大瞬間風向
-                    'Precp': rainfall,  # 當日降雨量
-                    'PrecpHour': rainfall_length,  # 降雨時數
-                    'SunShineHour': sunshine_hour,  # 日照時數
-                    'SunshineRate': sunshine_rate,  # 日照率
-                    'GloblRad': globl_rad,  # 全天空日射量
-                    'VisbMean': piece['Visibility']['Mean'],  # 能見度
-                    'UVImax': uvi_max,  # 最大紫外線
-                    'CloudAmount': cloud_amount  # 總雲量
-                })
-
-            return histroy_obs
+        try:
+            records = response.json()['data']
+            if len(records) == 0:
+                return None  # 測站於期間內無觀測資料
+            data = records[0]
+            data['stn_name'] = stn_name  # 將觀測站站名加入資料中
+        except Exception as e:
+            reason = f'回應內容解析失敗：{type(e).__name__} {e}'
+            fail(reason, reason)
+            return None
+
+        return data
+
+    # 轉換並整理資料
+    def __transform_historical_obs(self, item):
+        histroy_obs = []
+        stn_id = item['StationID']  # 觀測站代碼
+        stn_name = item['stn_name']  # 觀測站名稱
+        data = item['dts']
+
+        for piece in data:
+
+            # 轉換觀測日期格式
+            obs_date = datetime.datetime.strptime(
+                piece['DataDate'], "%Y-%m-%dT%H:%M:%S").timestamp()
+            obs_date = int(obs_date)
+
+            # 整理氣壓相關資料：測站未提供此資料，則為None；儀器故障的部分改為None
+            stn_pres = piece['StationPressure']['Mean']  # 測站氣壓
+            sea_pres = piece['SeaLevelPressure']['Mean']  # 海平面氣壓
+            if stn_pres == None or stn_pres < 0:
+                stn_pres = None
+            if sea_pres == None or sea_pres < 0:
+                sea_pres = None
+
+            # 整理相對濕度資料：測站未提供此資料，則為None；儀器故障的部分改為None
+            rh = piece['RelativeHumidity']['Mean']
+            if rh == None or rh < 0:
+                rh = None
+
+            # 整理氣溫相關資料：測站未提供此資料，則為None；儀器故障的部分改為None
+            temperature = piece['AirTemperature']['Mean']  # 單日平均氣溫
+            t_max = piece['AirTemperature']['Maximum']  # 單日最高氣溫
+            t_min = piece['AirTemperature']['Minimum']  # 單日最低氣溫
+            if temperature == None or temperature == -99.5:
+                temperature = None
+            if t_max == None or t_max == -99.5:
+                t_max = None
+            if t_max == None or t_min == -99.5:
+                t_min = None
+
+            # 整理風速相關資料：測站未提供此資料，則為None；儀器故障的部分改為None；風向未定則轉換為0
+            ws = piece['WindSpeed']['Mean']  # 風速
+            wd = piece['WindDirection']['Prevailing']  # 風向
+            ws_max = piece['PeakGust']['Maximum']  # 最大瞬間風速
+            wd_max = piece['PeakGust']['Direction']  # 最大瞬間風向
+            if ws == None or ws < 0:
+                ws = None
+            if wd == None or wd < 0:
+                wd = None
+            elif wd > 360:
+                wd = 0
+            if ws_max == None or ws_max < 0:
+                ws_max = None
+            if wd_max == None or wd_max < 0:
+                wd_max = None
+            elif wd_max > 360:
+                wd_max = 0
+
+            # 降雨量：測站未提供此資料，則為None；儀器故障的部分改為None；轉換雨跡
+            rainfall = piece['Precipitation']['Accumulation']  # 當日降雨量
+            if rainfall != None:
+                if rainfall == -9.8:
+                    rainfall = 0.05
+                elif rainfall < 0:
+                    rainfall = None
+            # 降雨時數：測站未提供此資料，則為None；儀器故障的部分改為None
+            rainfall_length = piece['PrecipitationDuration']['Total']
+            if rainfall_length == None or rainfall_length < 0:
+                rainfall_length = None
+
+            # 整理日照資料：測站未提供此資料，則為None；儀器故障的部分改為None
+            sunshine_hour = piece['SunshineDuration']['Total']  # 日照時數
+            sunshine_rate = piece['SunshineDuration']['Rate']  # 日照率
+            if sunshine_hour == None or sunshine_hour < 0:
+                sunshine_hour = None
+            if sunshine_rate == None or sunshine_rate < 0:
+                sunshine_rate = None
+            # 全天空日射量：測站未提供此資料，則為None；儀器故障的部分改為None
+            globl_rad = piece['GlobalSolarRadiation']['Accumulation']
+            if globl_rad == None or globl_rad < 0:
+                globl_rad = None
+
+            # 整理最大紫外線資料：測站未提供此資料，則為None；儀器故障的部分改為None
+            uvi_max = piece['UVIndex']['Maximum']
+            if uvi_max == None or uvi_max < 0:
+                uvi_max = None
+
+            # 整理總雲量資料：因濃霧無法觀察，定義為11
+            cloud_amount = piece['TotalCloudAmount']['Mean']
+            if cloud_amount == None:
+                cloud_amount == None
+            elif cloud_amount < 0:
+                cloud_amount = 11
+
+            histroy_obs.append({
+                'sID': stn_id,
+                'stn_name': stn_name,
+                'obs_date': obs_date,
+                'StnPres': stn_pres,  # 測站氣壓
+                'SeaPres': sea_pres,  # 海平面氣壓
+                'Temperature': temperature,  # 氣溫
+                'Tmax': t_max,  # 最高氣溫
+                'Tmin': t_min,  # 最低氣溫
+                'RH': rh,  # 相對溼度
+                'WS': ws,  # 風速
+                'WD': wd,  # 風向
+                'WSmax': ws_max,  # 最大瞬間風速
+                'WDmax': wd_max,  # 最大瞬間風向
+                'Precp': rainfall,  # 當日降雨量
+                'PrecpHour': rainfall_length,  # 降雨時數
+                'SunShineHour': sunshine_hour,  # 日照時數
+                'SunshineRate': sunshine_rate,  # 日照率
+                'GloblRad': globl_rad,  # 全天空日射量
+                'VisbMean': piece['Visibility']['Mean'],  # 能見度
+                'UVImax': uvi_max,  # 最大紫外線
+                'CloudAmount': cloud_amount  # 總雲量
+            })
+
+        return histroy_obs
+
+    # 取得測站於期間內已有資料的日期：first、last為datetime.date，回傳 {測站代碼: 日期集合}
+    def __historical_coverage(self, sids, first, last):
+        if len(sids) == 0:
+            return {}
+        syntax = text("""
+            SELECT k.sID, h.obs_date
+            FROM history_compact h
+            JOIN station_key k ON k.stn_key = h.stn_key
+            WHERE k.sID IN :stns
+            AND h.obs_date BETWEEN :start AND :end
+        """).bindparams(bindparam('stns', expanding=True))
+        _, rows = self.sql_operate.api_query_rows(syntax, {
+            'stns': list(sids),
+            'start': int(datetime.datetime.combine(first, datetime.time()).timestamp()),
+            'end': int(datetime.datetime.combine(last + datetime.timedelta(days=1), datetime.time()).timestamp()) - 1,
+        })
+
+        coverage = {}
+        for sid, obs_date in rows:
+            coverage.setdefault(sid, set()).add(datetime.date.fromtimestamp(obs_date))
+        return coverage
+
+    # 將datetime.date轉換為本地時區的arrow時間，供建構請求使用
+    @staticmethod
+    def __local_day(day):
+        return arrow.get(day.isoformat(), tzinfo='local')
+
+    # 爬取、並整理和寫入所有測站歷史觀測資料：job為背景工作(可省略)，用於回報進度與寫入筆數
+    # 依資料庫已有的日期規劃請求，只爬取缺漏的日期；撤站日期早於期間的測站不發送請求
+    # stations為測站代碼清單(可省略)，省略時為所有測站；爬取失敗的測站月份記錄於 fetch_dead_letter
+    def etl_historical_obs(self, start_date, end_date, job=None, stations=None):
+        # 撈取觀測站清單
+        # syntax = """SELECT sID, stn_name FROM station_list"""
+        if stations is None:
+            syntax = """
+                SELECT sID, stn_name, start_date, end_date
+                FROM station_list
+            """
+            station_list = self.sql_operate.query(syntax)
+        else:
+            syntax = text("""
+                SELECT sID, stn_name, start_date, end_date
+                FROM station_list
+                WHERE sID IN :stns
+            """).bindparams(bindparam('stns', expanding=True))
+            station_list = self.sql_operate.api_query(syntax, {'stns': list(stations)})
+
+        failures = {}  # (測站代碼, 月份) -> 錯誤訊息
+
+        # 規劃請求：每個測站月份僅請求缺漏的日期範圍
+        first = start_date.date()
+        last = end_date.date()
+        coverage = self.__historical_coverage([item['sID'] for item in station_list], first, last)
+        plan = plan_requests(station_list, coverage, first, last)
+        print(f'歷史觀測資料請求規劃：{len(station_list)} 個測站，需發送 {len(plan)} 個請求')
 
         # 生成爬蟲所需的資料清單
-        requests_list = list(
-            map(partial(requests_params, st=start_date, et=end_date), station_list))
+        requests_list = [self.__historical_params(item, self.__local_day(item['start']), self.__local_day(item['end']))
+                         for item in plan]
 
         # 使用多線程爬蟲與初步處理資料
-        original_data_list = self.__multi_thread_task(
-            web_requests_post, requests_list, desc='歷史觀測資料爬取進度')
+        with ETL_STAGE_SECONDS.time(task='historical', stage='fetch'):
+            original_data_list = self.__fetch_all(
+                partial(self.__fetch_historical, failures=failures, job=job), requests_list,
+                desc='歷史觀測資料爬取進度', job=job)
 
         # 移除空缺元素
         data_list = [item for item in original_data_list if item != None]
 
-        # 使用多線程處理資料
-        data_bunchs = self.__multi_thread_task(
-            transform_historical_obs, data_list, desc='資料整理進度')
+        with ETL_STAGE_SECONDS.time(task='historical', stage='transform'):
+            # 使用多線程處理資料
+            data_bunchs = self.__multi_thread_task(
+                self.__transform_historical_obs, data_list, desc='資料整理進度', job=job)
 
-        # 將多個list合併為一串列
-        data = [element for item in data_bunchs for element in item]
+            # 將多個list合併為一串列
+            data = [element for item in data_bunchs for element in item]
 
-        # 按測站代號升序，再日期升序
-        data = sorted(data, key=lambda item: (item['sID']))
-        data = sorted(data, key=lambda item: (item['obs_date']))
+            # 按測站代號升序，再日期升序
+            data = sorted(data, key=lambda item: (item['sID']))
+            data = sorted(data, key=lambda item: (item['obs_date']))
 
         # 寫入資料庫
-        self.sql_operate.upsert(DataHistory, data)
+        with ETL_STAGE_SECONDS.time(task='historical', stage='write'):
+            result = self.write_historical_obs(data)
+        self.__report_written(job, result, len(data))
+
+        # 依月份記錄爬取失敗的測站；資料寫入成功時，清除其餘測站先前的失敗紀錄
+        months = {}  # 月份 -> 期間內運作中的測站代碼
+        for item in station_list:
+            span = station_span(item, first, last)
+            for window_first, _ in month_windows(*span) if span is not None else []:
+                months.setdefault(window_first.strftime('%Y-%m'), []).append(item['sID'])
+
+        for month, sids in months.items():
+            month_failures = {sid: error for (sid, failed_month), error in failures.items() if failed_month == month}
+            succeeded = [] if result is None else [sid for sid in sids if sid not in month_failures]
+            self.__update_dead_letters(month, month_failures, succeeded)
+
+    # 建立歷史資料回補的工作清單表
+    def build_backfill_manifest_table(self):
+        self.sql_operate.create_table(BACKFILL_MANIFEST_SYNTAX)
+
+    # 規劃回補的測站月份：包含已撤站的測站，並依設站與撤站日期裁切期間
+    # 回傳依月份、測站代碼排序的List of Dict {sID, stn_name, month, start, end}
+    def __plan_backfill(self, start_month, end_month, stations):
+        syntax = """
+            SELECT sID, stn_name, start_date, end_date
+            FROM station_list
+        """
+        station_list = self.sql_operate.query(syntax)
+        if stations is not None:
+            stations = set(stations)
+            station_list = [item for item in station_list if item['sID'] in stations]
+
+        first = arrow.get(start_month, 'YYYY-MM').date()
+        last = min(arrow.get(end_month, 'YYYY-MM').ceil('month').date(), arrow.now().date())
+
+        units = []
+        for item in station_list:
+            span = station_span(item, first, last)
+            for window_first, window_last in month_windows(*span) if span is not None else []:
+                units.append({'sID': item['sID'], 'stn_name': item['stn_name'],
+                              'month': window_first.strftime('%Y-%m'), 'start': window_first, 'end': window_last})
+
+        units.sort(key=lambda unit: (unit['month'], unit['sID']))
+        return units
+
+    # 依資料庫已有的日期縮小回補請求的範圍：回傳 (仍有缺漏的測站月份, 已無缺漏的測站月份)
+    def __narrow_backfill(self, units):
+        months = {}
+        for unit in units:
+            months.setdefault(unit['month'], []).append(unit)
+
+        narrowed = []
+        covered = []
+        for month_units in months.values():
+            coverage = self.__historical_coverage(
+                [unit['sID'] for unit in month_units],
+                min(unit['start'] for unit in month_units), max(unit['end'] for unit in month_units))
+            for unit in month_units:
+                window = missing_window(coverage.get(unit['sID'], set()), unit['start'], unit['end'])
+                if window is None:
+                    covered.append(unit)
+                else:
+                    narrowed.append({**unit, 'start': window[0], 'end': window[1]})
+
+        return narrowed, covered
+
+    # 標記回補的測站月份：marks為List of Dict {sID, month, status(done或failed), rows(寫入的資料筆數)}
+    def __mark_backfill_units(self, marks, connection):
+        fetched_at = int(time.time())
+        connection.execute(text("""
+            UPDATE backfill_manifest
+            SET status = :status, rows = :rows, fetched_at = :fetched_at
+            WHERE sID = :sID AND month = :month
+        """), [{**mark, 'fetched_at': fetched_at} for mark in marks])
+        return ['backfill_manifest']
+
+    # 回補歷史觀測資料：依工作清單爬取各測站月份，每個測站月份整理完成後立即寫入並標記完成，中斷後重新執行即可續傳
+    # start_month、end_month為月份(YYYY-MM，end_month省略時為本月)；stations為測站代碼清單(可省略)，包含已撤站的測站
+    # restart為True時重新爬取範圍內所有測站月份；job為背景工作(可省略)，用於回報進度、剩餘時間與寫入筆數
+    def backfill_historical_obs(self, job=None, start_month='1990-01', end_month=None, stations=None, restart=False):
+        end_month = end_month or arrow.now().format('YYYY-MM')
+        units = self.__plan_backfill(start_month, end_month, stations)
+        completed = set()  # 已完成的 (測站代碼, 月份)
+
+        # 將規劃的測站月份加入工作清單，並取得已完成的部分
+        def prepare(connection):
+            connection.exec_driver_sql(BACKFILL_MANIFEST_SYNTAX)
+            if len(units) == 0:
+                return []
+            connection.execute(text("""
+                INSERT OR IGNORE INTO backfill_manifest (sID, month, status)
+                VALUES (:sID, :month, 'pending')
+            """), units)
+            if restart:
+                connection.execute(text("""
+                    UPDATE backfill_manifest SET status = 'pending'
+                    WHERE sID = :sID AND month = :month
+                """), units)
+            done = connection.execute(text("""
+                SELECT sID, month
+                FROM backfill_manifest
+                WHERE status = 'done'
+                AND month BETWEEN :start_month AND :end_month
+            """), {'start_month': start_month, 'end_month': end_month})
+            completed.update((row.sID, row.month) for row in done)
+            return ['backfill_manifest']
+
+        self.sql_operate.execute_write(prepare)
+        pending = [unit for unit in units if (unit['sID'], unit['month']) not in completed]
+
+        # 資料庫已有完整資料的測站月份不需爬取，直接標記完成；其餘只請求缺漏的日期範圍
+        covered = []
+        if not restart:
+            pending, covered = self.__narrow_backfill(pending)
+            if len(covered) > 0:
+                self.sql_operate.execute_write(partial(self.__mark_backfill_units, [
+                    {'sID': unit['sID'], 'month': unit['month'], 'status': 'done', 'rows': 0} for unit in covered]))
+        print(f'歷史資料回補：共 {len(units)} 個測站月份，已完成 {len(units) - len(pending) - len(covered)} 個，'
+              f'資料已完整 {len(covered)} 個，待爬取 {len(pending)} 個')
+
+        writer = ThreadPoolExecutor(max_workers=1)  # 依序寫入資料庫，不阻塞爬蟲
+
+        # 寫入單一測站月份，並更新工作清單與爬取失敗紀錄；寫入失敗時標記為failed，不影響其他測站月份
+        def commit(unit, data, error):
+            if error is None:
+                try:
+                    result = self.write_historical_obs(data)
+                except Exception as e:
+                    error = f'資料寫入失敗：{type(e).__name__} {e}'
+                    if job is not None:
+                        job.add_error(f'{unit["stn_name"]}({unit["sID"]}) {unit["month"]} {error}')
+                else:
+                    self.__report_written(job, result, len(data))
+                    if result is None:
+                        error = '資料寫入失敗'
 
-    # 更新歷史資料
-    def update_historical_data(self):
+            status = 'done' if error is None else 'failed'
+            try:
+                self.sql_operate.execute_write(partial(self.__mark_backfill_units, [{
+                    'sID': unit['sID'], 'month': unit['month'], 'status': status,
+                    'rows': len(data) if error is None else 0}]))
+                if error is None:
+                    self.__update_dead_letters(unit['month'], {}, [unit['sID']])
+                else:
+                    self.__update_dead_letters(unit['month'], {unit['sID']: error}, [])
+            except Exception as e:
+                print(e)
+                if job is not None:
+                    job.add_error(f'{unit["sID"]} {unit["month"]} 工作清單更新失敗：{type(e).__name__} {e}')
+
+        # 爬取並整理單一測站月份，完成後交由寫入執行緒；失敗時標記為failed並記錄為爬取失敗，繼續處理其他測站月份
+        async def run_unit(fetcher, unit):
+            params = self.__historical_params(unit, self.__local_day(unit['start']), self.__local_day(unit['end']))
+            failures = {}
+            data = []
+            try:
+                item = await self.__fetch_historical(fetcher, params, failures, job)
+                error = failures.get((unit['sID'], unit['month']))
+                if item is not None:
+                    data = self.__transform_historical_obs(item)
+            except Exception as e:
+                error = f'資料整理失敗：{type(e).__name__} {e}'
+                if job is not None:
+                    job.add_error(f'{unit["stn_name"]}({unit["sID"]}) {unit["month"]} {error}')
+            await asyncio.get_running_loop().run_in_executor(writer, commit, unit, data, error)
+
+        try:
+            with ETL_STAGE_SECONDS.time(task='backfill', stage='run'):
+                self.__fetch_all(run_unit, pending, desc='歷史資料回補進度', job=job)
+        finally:
+            writer.shutdown()
+
+    # 取得歷史資料回補的進度：依狀態統計測站月份數量與寫入筆數；start_month、end_month可省略
+    # 尚未建立工作清單(未曾回補)時回傳空列表
+    def backfill_progress(self, start_month=None, end_month=None):
+        if not self.sql_operate.has_table('backfill_manifest'):
+            return []
+        return self.sql_operate.api_query("""
+            SELECT status, COUNT(*) AS units, SUM(rows) AS rows, MAX(fetched_at) AS last_fetched_at
+            FROM backfill_manifest
+            WHERE (:start_month IS NULL OR month >= :start_month)
+            AND (:end_month IS NULL OR month <= :end_month)
+            GROUP BY status
+        """, {'start_month': start_month, 'end_month': end_month})
+
+    # 更新歷史資料：先重試先前月份爬取失敗的測站，再更新本月資料(只爬取本月尚缺的日期)
+    def update_historical_data(self, job=None):
         st = arrow.now().floor("month")
         et = arrow.now().ceil("month").floor("day")
-        self.etl_historical_obs(st, et)
+        self.retry_dead_letters(job=job, before=st.format('YYYY-MM'))
+        self.etl_historical_obs(st, et, job=job)
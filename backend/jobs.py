@@ -0,0 +1,142 @@
+import time
+import uuid
+import threading
+import traceback
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    '''
+    背景工作：記錄執行狀態、進度、寫入筆數與錯誤訊息
+    '''
+
+    # max_errors：保留的錯誤訊息數量，超過時僅保留最近的訊息，總數見error_count
+    def __init__(self, name, max_errors=100) -> None:
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.status = 'queued'  # queued、running、succeeded、failed
+        self.done = 0  # 已完成的項目數
+        self.total = None  # 總項目數(未知時為None)
+        self.rows_written = 0  # 寫入資料庫的筆數(新增與更新)
+        self.rows_unchanged = 0  # 與資料庫內容相同而略過的筆數
+        self.errors = deque(maxlen=max_errors)  # 最近的錯誤訊息
+        self.error_count = 0  # 累計錯誤數量
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.stage_started_at = None  # 目前階段的開始時間，用於估計剩餘時間
+        self.lock = threading.Lock()
+
+    # 是否仍在排隊或執行中
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+
+    # 設定總項目數，並重設已完成數量(用於分階段的工作)
+    def set_total(self, total):
+        with self.lock:
+            self.total = total
+            self.done = 0
+            self.stage_started_at = time.time()
+
+    # 增加已完成的項目數
+    def advance(self, n=1):
+        with self.lock:
+            self.done += n
+
+    # 累計寫入資料庫的筆數；unchanged為與資料庫內容相同而略過的筆數
+    def add_rows(self, n, unchanged=0):
+        with self.lock:
+            self.rows_written += n
+            self.rows_unchanged += unchanged
+
+    # 記錄錯誤訊息
+    def add_error(self, message):
+        with self.lock:
+            self.errors.append(str(message))
+            self.error_count += 1
+
+    # 估計目前階段的剩餘秒數：依已完成項目的平均時間推算，尚無完成項目時為None
+    def eta(self):
+        if self.total is None or self.done == 0 or self.stage_started_at is None:
+            return None
+        elapsed = time.time() - self.stage_started_at
+        return round(elapsed / self.done * max(self.total - self.done, 0), 1)
+
+    # 轉換為Dict，供API回傳
+    def to_dict(self):
+        with self.lock:
+            return {
+                'id': self.id,
+                'name': self.name,
+                'status': self.status,
+                'done': self.done,
+                'total': self.total,
+                'eta': self.eta() if self.active else None,
+                'rows_written': self.rows_written,
+                'rows_unchanged': self.rows_unchanged,
+                'errors': list(self.errors),
+                'error_count': self.error_count,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+            }
+
+
+class JobRunner:
+    '''
+    背景工作執行器：於專用執行緒依序執行資料更新工作，相同名稱的工作執行中時不重複建立
+    '''
+
+    def __init__(self, max_workers=1, max_history=100, name='job_runner') -> None:
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name)
+        self.max_history = max_history
+        self.jobs = OrderedDict()  # 工作紀錄：id -> Job
+        self.lock = threading.Lock()
+
+    # 提交工作：func需接受Job參數；若同名工作仍在排隊或執行中，回傳該工作而不重新建立
+    def submit(self, name, func):
+        with self.lock:
+            for job in self.jobs.values():
+                if job.name == name and job.active:
+                    return job
+
+            job = Job(name)
+            self.jobs[job.id] = job
+
+            # 僅保留最近的工作紀錄
+            while len(self.jobs) > self.max_history:
+                oldest_id = next(iter(self.jobs))
+                if self.jobs[oldest_id].active:
+                    break
+                del self.jobs[oldest_id]
+
+        self.executor.submit(self.__run, job, func)
+        return job
+
+    # 取得工作
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    # 列出所有工作紀錄(新到舊)
+    def list(self):
+        with self.lock:
+            return list(reversed(self.jobs.values()))
+
+    # 執行工作並記錄結果
+    def __run(self, job, func):
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            func(job)
+            processed = job.rows_written + job.rows_unchanged
+            job.status = 'failed' if job.error_count != 0 and processed == 0 else 'succeeded'
+        except Exception as e:
+            job.add_error(f'{type(e).__name__}: {e}')
+            traceback.print_exc()
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
@@ -1,11 +1,242 @@
+import os
+import time
+import datetime
+from functools import partial
+from itertools import chain
 from typing import Optional
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Match
+from sqlalchemy import bindparam, text
 from backend.dataprocessing import *
+from backend.cache import ResponseCache
+from backend.jobs import JobRunner
+from backend.scheduler import Scheduler
+from backend.spatial import StationIndex
+from backend.rollups import ROLLUP_LEVELS, ROLLUP_COLUMNS
+from backend.prefixsums import PREFIX_COLUMNS, PREFIX_LOOKUP_SYNTAX, range_stats
+from backend.metrics import HTTP_REQUESTS, HTTP_REQUEST_SECONDS, HTTP_IN_FLIGHT, render_metrics
+from backend.responses import negotiate_format, json_response, ndjson_response, tabular_response
 
-sql_operate = SQLOperate()
+# 慢查詢紀錄：設定環境變數 SLOW_QUERY_MS(毫秒)時啟用，記錄超過門檻的查詢與其查詢計畫
+SLOW_QUERY_MS = os.environ.get('SLOW_QUERY_MS')
+sql_operate = SQLOperate(
+    slow_query_threshold=float(SLOW_QUERY_MS) / 1000 if SLOW_QUERY_MS else None)
 data_pipeline = DataPipeline()
+response_cache = ResponseCache()  # API回應快取
+job_runner = JobRunner(max_workers=2)  # 背景工作執行器：即時與歷史資料更新可同時進行
+backfill_runner = JobRunner(max_workers=1, name='backfill_runner')  # 回補與手動重試另外執行，不佔用定期更新
+scheduler = Scheduler(job_runner, sql_operate)  # 定期資料更新排程
+station_index = StationIndex(sql_operate)  # 觀測站空間索引
 app = FastAPI()  # 建立一個 Fast API application
 
+# 即時觀測資料(O-A0003-001每10分鐘發布)：每10分鐘的第3分鐘更新，隨機延遲0~60秒
+scheduler.add('realtime', data_pipeline.etl_realtime_obs,
+              interval=600, offset=180, jitter=60)
+# 歷史觀測資料：每日臺灣時間03:00(UTC 19:00)更新，隨機延遲0~30分鐘
+scheduler.add('history', data_pipeline.update_historical_data,
+              interval=86400, offset=19 * 3600, jitter=1800)
+
+# 歷史資料：可查詢的欄位與預設回傳欄位
+HISTORY_FIELDS = [column.name for column in DataHistory.__table__.columns]
+HISTORY_DEFAULT_FIELDS = ['obs_date', 'Precp', 'WS', 'WSmax', 'Temperature', 'RH', 'UVImax']
+# 歷史資料：分頁筆數上限
+HISTORY_MAX_PAGE_SIZE = 10000
+
+# 多測站查詢：測站數量 × 查詢天數的上限
+HISTORY_MULTI_MAX_CELLS = 200000
+
+# 時間彙整：可彙整的觀測項目
+AGGREGATE_COLUMNS = ['Temperature', 'Tmax', 'Tmin', 'Precp', 'RH', 'WS', 'WSmax']
+# 時間彙整：統計方式與對應的SQL函式
+AGGREGATE_STATS = {
+    'mean': 'AVG',
+    'min': 'MIN',
+    'max': 'MAX',
+    'sum': 'SUM',
+    'count': 'COUNT',
+}
+# 時間彙整：觀測日期轉為臺灣時間(UTC+8)的日期字串
+LOCAL_DATE = "date(obs_date + 28800, 'unixepoch')"
+# 時間彙整：各時間單位的區間起始日期(週：週一、季：氣象季節，12~2月為冬季)
+AGGREGATE_FREQS = {
+    'day': LOCAL_DATE,
+    'week': f"date({LOCAL_DATE}, 'weekday 0', '-6 days')",
+    'month': f"date({LOCAL_DATE}, 'start of month')",
+    'season': f"""date(printf('%04d-%02d-01',
+        ((CAST(strftime('%Y', {LOCAL_DATE}) AS INTEGER) * 12 + CAST(strftime('%m', {LOCAL_DATE}) AS INTEGER)) / 3 * 3 - 1) / 12,
+        ((CAST(strftime('%Y', {LOCAL_DATE}) AS INTEGER) * 12 + CAST(strftime('%m', {LOCAL_DATE}) AS INTEGER)) / 3 * 3 - 1) % 12 + 1))""",
+    'year': f"date({LOCAL_DATE}, 'start of year')",
+}
+
+# 彙整表：區間起始日期(臺灣時間)的SQL運算式
+ROLLUP_PERIOD_DATES = {
+    'month': "printf('%04d-%02d-01', year, month)",
+    'year': "printf('%04d-01-01', year)",
+}
+# 臺灣時區
+TAIWAN_TZ = datetime.timezone(datetime.timedelta(hours=8))
+# 月份格式(YYYY-MM)
+MONTH_PATTERN = r'^\d{4}-(0[1-9]|1[0-2])$'
+
+
+# JSON回傳形式：split(預設)為欄位名稱與二維陣列，資料列直接序列化；records為逐筆物件，需逐筆建立Dict
+ORIENT_QUERY = Query('split', pattern='^(records|split)$')
+
+
+# 依請求的格式回傳查詢結果：json(預設)、ndjson串流，或Arrow IPC/Parquet/CSV列式格式
+# json格式直接由資料列序列化為位元組，不經過jsonable_encoder
+# page_size：分頁筆數(語法須包含 LIMIT :limit 與 obs_date 欄位)，尚有資料時以 next(最後一筆的obs_date)作為下一頁的游標
+# 分頁查詢的筆數有上限，ndjson格式不使用串流，與列式格式相同於標頭 X-Next-Cursor 回傳游標
+async def query_response(request: Request, syntax, syntax_params, format=None, stream=None, orient='split',
+                         page_size=None):
+    fmt = negotiate_format(request, format, stream)
+
+    if page_size is None and 'limit' in syntax_params:
+        syntax_params['limit'] = -1  # SQLite的LIMIT為負數時不限筆數
+    elif page_size is not None:
+        syntax_params['limit'] = page_size + 1  # 多取一筆，用以判斷是否還有下一頁
+
+    if fmt == 'ndjson' and page_size is None:
+        # 於資料庫執行緒池取得第一批資料(同時取得串流連線)，串流數量已達上限時回傳503
+        chunks = sql_operate.iter_api_query(syntax, syntax_params)
+        try:
+            first = await sql_operate.run_async(next, chunks, None)
+        except StreamLimitError as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={'Retry-After': '5'})
+        return ndjson_response(chain([] if first is None else [first], chunks))
+
+    column_names, rows = await sql_operate.async_api_query_rows(syntax, syntax_params)
+
+    next_cursor = None
+    if page_size is not None and len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = rows[-1][column_names.index('obs_date')]
+
+    if fmt == 'ndjson':
+        response = ndjson_response([[dict(zip(column_names, row)) for row in rows]])
+    elif fmt in ('arrow', 'parquet', 'csv'):
+        response = await sql_operate.run_async(tabular_response, column_names, rows, fmt)
+    else:
+        response = await sql_operate.run_async(
+            json_response, column_names, rows, orient,
+            paginated=page_size is not None, next_cursor=next_cursor)
+
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
+
+
+# 多測站查詢結果依測站分組：回傳 {測站代碼: List of Dict}
+def group_by_station(column_names, rows, stn_list):
+    value_names = column_names[1:]
+    grouped = {stn: [] for stn in stn_list}
+    for row in rows:
+        grouped[row[0]].append(dict(zip(value_names, row[1:])))
+
+    return grouped
+
+
+# 多測站查詢結果轉為對齊矩陣：各觀測項目皆為「日期 × 測站」的二維陣列，缺值為None
+def to_station_matrix(column_names, rows, stn_list):
+    value_names = column_names[2:]
+    dates = sorted({row[1] for row in rows})
+    date_index = {obs_date: idx for idx, obs_date in enumerate(dates)}
+    stn_index = {stn: idx for idx, stn in enumerate(stn_list)}
+
+    values = {name: [[None] * len(stn_list) for _ in dates]
+              for name in value_names}
+    for row in rows:
+        i = date_index[row[1]]
+        j = stn_index[row[0]]
+        for name, value in zip(value_names, row[2:]):
+            values[name][i][j] = value
+
+    return {'obs_date': dates, 'stations': stn_list, 'values': values}
+
+
+# 以快取回傳查詢結果：依端點、查詢參數、回傳格式與相關資料表的版本建立快取鍵，支援ETag/If-None-Match
+async def cached_response(request: Request, tables, build):
+    params = request.query_params
+    fmt = negotiate_format(request, params.get('format'), params.get('stream'))
+
+    # NDJSON為串流回傳，不經過快取
+    if fmt == 'ndjson':
+        return await build()
+
+    key = response_cache.make_key(
+        request.url.path, params.multi_items(), fmt, SQLOperate.get_versions(tables))
+    etag = response_cache.etag(key)
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+
+    # 用戶端的版本與目前一致：直接回傳304，不需查詢資料庫
+    if_none_match = request.headers.get('if-none-match', '')
+    if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+        return Response(status_code=304, headers=headers)
+
+    cached = await response_cache.get_or_build(key, build)
+    return Response(content=cached.body, media_type=cached.media_type, headers={**cached.headers, **headers})
+
+
+# 回傳已受理的背景工作：狀態碼202，並以Location標頭指向工作查詢網址
+def job_accepted(job):
+    headers = {'Location': f'/jobs/{job.id}', 'X-Job-Id': job.id}
+    return JSONResponse(job.to_dict(), status_code=202, headers=headers)
+
+
+# 解析經緯度範圍字串：「最小經度,最小緯度,最大經度,最大緯度」
+def parse_bbox(bbox):
+    try:
+        min_lon, min_lat, max_lon, max_lat = [float(value) for value in bbox.split(',')]
+    except ValueError:
+        raise HTTPException(
+            status_code=422, detail='bbox 格式須為「最小經度,最小緯度,最大經度,最大緯度」')
+    if min_lon > max_lon or min_lat > max_lat:
+        raise HTTPException(status_code=422, detail='bbox 的最小值不可大於最大值')
+
+    return min_lon, min_lat, max_lon, max_lat
+
+
+# 取得請求對應的路由路徑(例如 /jobs/{job_id})，作為監控指標的標籤，避免路徑參數造成標籤數量無限增加
+def route_path(request: Request):
+    for route in app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return 'unmatched'
+
+
+@app.middleware("http")
+# 記錄各路由的請求次數、處理時間與處理中的請求數量
+async def record_metrics(request: Request, call_next):
+    method = request.method
+    route = route_path(request)
+    HTTP_IN_FLIGHT.inc(method=method, route=route)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start, method=method, route=route)
+        HTTP_REQUESTS.inc(method=method, route=route, status=status)
+        HTTP_IN_FLIGHT.dec(method=method, route=route)
+
+
+@app.on_event("startup")
+# 啟動排程：可設定環境變數 SCHEDULER_ENABLED=0 停用
+async def start_scheduler():
+    if os.environ.get('SCHEDULER_ENABLED', '1') != '0':
+        await scheduler.start()
+
+
+@app.on_event("shutdown")
+# 停止排程
+async def stop_scheduler():
+    await scheduler.stop()
+
 
 @app.get("/")
 # 根目錄
@@ -15,7 +246,7 @@ async def root():
 
 @app.get("/stations")
 # 回傳觀測站清單
-async def station_list():
+async def station_list(request: Request):
     """
     取得所有觀測站
     """
@@ -24,15 +255,48 @@ async def station_list():
         SELECT sID, stn_name, lon, lat, state
         FROM station_list
     """
-    data = sql_operate.query(syntax)
-    return {"data": data}
+
+    async def build():
+        data = await sql_operate.async_query(syntax)
+        return {"data": data}
+
+    return await cached_response(request, ['station_list'], build)
+
+
+@app.get("/stations/nearest")
+# 回傳距離指定位置最近的觀測站
+async def station_nearest(request: Request, lon: float, lat: float,
+                          k: int = Query(5, ge=1, le=100), active: bool = False):
+    """
+    查詢距離指定經緯度最近的k個觀測站，由近到遠排序
+
+    - 輸入：
+    1. lon：經度
+    2. lat：緯度
+    3. k：回傳的觀測站數量(1~100)
+    4. active：是否僅包含現存觀測站
+
+    - 輸出：觀測站資料，並附上距離distance_km(公里)
+    """
+
+    async def build():
+        data = await sql_operate.run_async(station_index.nearest, lon, lat, k, active)
+        return {"data": data}
+
+    return await cached_response(request, ['station_list'], build)
 
 
 @app.get("/realtime")
 # 回傳觀測資料
-async def weather_realtime_data():
+async def weather_realtime_data(request: Request, bbox: Optional[str] = None, format: Optional[str] = None,
+                                orient: str = ORIENT_QUERY):
     """
     回傳現存觀測站的觀測資料
+
+    - 輸入：
+    1. bbox：經緯度範圍(可省略)，格式為「最小經度,最小緯度,最大經度,最大緯度」，僅回傳範圍內的觀測站
+    2. format：回傳格式，可為json、arrow、parquet、csv(亦可使用標頭Accept指定)
+    3. orient：json的回傳形式，split(預設)為 {"columns": [...], "data": [[...]]}，records為逐筆物件
     """
 
     syntax = """
@@ -41,8 +305,78 @@ async def weather_realtime_data():
         ON s.sID = r.sID
         WHERE s.state = 1
     """
-    data = sql_operate.query(syntax)
-    return {"data": data}
+    syntax_params = {}
+
+    # 以空間索引找出範圍內的觀測站，再以主鍵查詢觀測資料
+    if bbox is not None:
+        min_lon, min_lat, max_lon, max_lat = parse_bbox(bbox)
+        stations = await sql_operate.run_async(
+            station_index.within, min_lon, min_lat, max_lon, max_lat)
+        syntax = text(syntax + """
+        AND s.sID IN :stns
+        """).bindparams(bindparam('stns', expanding=True))
+        syntax_params = {'stns': [item['sID'] for item in stations]}
+
+    return await cached_response(
+        request, ['station_list', 'data_realtime'],
+        lambda: query_response(request, syntax, syntax_params, format, orient=orient))
+
+
+@app.get("/realtime/series")
+# 回傳單一測站之即時觀測時間序列
+async def weather_realtime_series(request: Request, stn: str, since: int, until: Optional[int] = None,
+                                  resolution: str = 'raw', format: Optional[str] = None,
+                                  orient: str = ORIENT_QUERY):
+    """
+    查詢單一觀測站的即時觀測時間序列
+
+    - 輸入：
+    1. stn：觀測站代碼
+    2. since：查詢起始時間(格式為時間戳)
+    3. until：查詢結束時間(格式為時間戳，可省略)
+    4. resolution：raw為原始資料(僅保留最近數日)，hourly為每小時彙整(包含已彙整的較舊資料)
+    5. format：回傳格式，可為json、ndjson、arrow、parquet、csv(亦可使用標頭Accept指定)
+    6. orient：json的回傳形式，split(預設)為 {"columns": [...], "data": [[...]]}，records為逐筆物件
+    """
+
+    if resolution not in ('raw', 'hourly'):
+        raise HTTPException(
+            status_code=422, detail='resolution 必須為 raw 或 hourly')
+
+    syntax_params = {
+        'stn': stn,
+        'since': since,
+        'until': until if until is not None else 2 ** 62,
+    }
+
+    # 依主鍵(sID, obs_time)範圍掃描
+    if resolution == 'raw':
+        syntax = """
+            SELECT obs_time, Precp, WD, WS, Temperature, RH, UVI
+            FROM realtime_series
+            WHERE sID = :stn
+            AND obs_time BETWEEN :since AND :until
+            ORDER BY obs_time
+        """
+    else:
+        # 已彙整的每小時資料，加上尚未彙整的原始資料即時彙整；彙整以整點切分，兩者的小時不會重疊
+        syntax = f"""
+            SELECT obs_time, {', '.join(REALTIME_HOURLY_COLUMNS)}
+            FROM realtime_hourly
+            WHERE sID = :stn
+            AND obs_time BETWEEN :since / 3600 * 3600 AND :until
+            UNION ALL
+            SELECT obs_time / 3600 * 3600 AS obs_time, {', '.join(REALTIME_HOURLY_COLUMNS.values())}
+            FROM realtime_series
+            WHERE sID = :stn
+            AND obs_time BETWEEN :since AND :until
+            GROUP BY obs_time / 3600 * 3600
+            ORDER BY obs_time
+        """
+
+    return await cached_response(
+        request, ['realtime_series', 'realtime_hourly'],
+        lambda: query_response(request, syntax, syntax_params, format, orient=orient))
 
 
 @app.put("/realtime")
@@ -50,10 +384,12 @@ async def weather_realtime_data():
 async def weather_realtime_data_update():
     """
     更新現存觀測站的觀測資料
+
+    - 於背景執行，立即回傳202與工作資訊；更新進行中時重複請求會回傳同一個工作
     """
 
-    data_pipeline.etl_realtime_obs()
-    return {"message": "Refresh successful!"}
+    job = job_runner.submit('realtime', data_pipeline.etl_realtime_obs)
+    return job_accepted(job)
 
 
 @app.head("/history")
@@ -61,15 +397,186 @@ async def weather_realtime_data_update():
 async def weather_historical_data_update():
     """
     更新所有觀測站的歷史觀測資料
+
+    - 於背景執行，立即回傳202，工作代碼見標頭X-Job-Id；更新進行中時重複請求會回傳同一個工作
+    """
+
+    job = job_runner.submit('history', data_pipeline.update_historical_data)
+    return job_accepted(job)
+
+
+@app.put("/history/backfill")
+# 回補歷史觀測資料
+async def weather_historical_data_backfill(start_month: str = Query('1990-01', pattern=MONTH_PATTERN),
+                                           end_month: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+                                           stns: Optional[str] = None, restart: bool = False):
+    """
+    依工作清單回補歷史觀測資料(含已撤站的測站)，每個測站月份寫入後立即標記完成；中斷後重新請求即可續傳，已完成的測站月份會略過
+
+    - 輸入：
+    1. start_month：回補起始月份(YYYY-MM)，預設為1990-01
+    2. end_month：回補結束月份(YYYY-MM)，省略時為本月
+    3. stns：觀測站代碼(以逗號分隔)，省略時為所有測站
+    4. restart：是否重新爬取範圍內已完成的測站月份
+
+    - 於背景執行，立即回傳202，工作代碼見標頭X-Job-Id，工作狀態含剩餘時間估計；回補進行中時重複請求會回傳同一個工作
+    """
+
+    stn_list = None
+    if stns is not None:
+        stn_list = list(dict.fromkeys(
+            stn.strip() for stn in stns.split(',') if stn.strip()))
+    if end_month is not None and end_month < start_month:
+        raise HTTPException(status_code=422, detail='end_month 不可早於 start_month')
+
+    job = backfill_runner.submit('backfill', partial(
+        data_pipeline.backfill_historical_obs, start_month=start_month, end_month=end_month,
+        stations=stn_list, restart=restart))
+    return job_accepted(job)
+
+
+@app.get("/history/backfill")
+# 回傳歷史資料回補進度
+async def weather_historical_data_backfill_progress(start_month: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+                                                    end_month: Optional[str] = Query(None, pattern=MONTH_PATTERN)):
+    """
+    依狀態(pending、done、failed)統計回補工作清單的測站月份數量、寫入筆數與最後爬取時間
+
+    - 輸入：
+    1. start_month：起始月份(YYYY-MM，可省略)
+    2. end_month：結束月份(YYYY-MM，可省略)
+    """
+
+    data = await sql_operate.run_async(data_pipeline.backfill_progress, start_month, end_month)
+    return {"data": data}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+# 回傳監控指標
+async def metrics():
+    """
+    以Prometheus文字格式回傳監控指標：API請求、資料庫操作、資料處理管線與爬蟲
+    """
+
+    return PlainTextResponse(render_metrics(), media_type='text/plain; version=0.0.4')
+
+
+@app.get("/admin/slow_queries")
+# 回傳慢查詢紀錄
+async def slow_query_list():
+    """
+    取得最近的慢查詢紀錄(新到舊)：SQL語法、參數、資料筆數、執行時間、等待連線時間與查詢計畫
+
+    - 需設定環境變數 SLOW_QUERY_MS(毫秒)啟用
+    """
+
+    slow_query_log = sql_operate.slow_query_log
+    if slow_query_log is None:
+        return {"enabled": False, "threshold_ms": None, "total": 0, "data": []}
+    return {
+        "enabled": True,
+        "threshold_ms": slow_query_log.threshold * 1000,
+        "total": slow_query_log.total,
+        "data": slow_query_log.list(),
+    }
+
+
+@app.delete("/admin/slow_queries")
+# 清除慢查詢紀錄
+async def slow_query_clear():
+    """
+    清除所有慢查詢紀錄
+    """
+
+    if sql_operate.slow_query_log is not None:
+        sql_operate.slow_query_log.clear()
+    return Response(status_code=204)
+
+
+@app.get("/admin/crawler")
+# 回傳爬蟲速率狀態
+async def crawler_status():
+    """
+    取得爬蟲各主機目前的請求速率(每秒請求數)、速率上下限、可用令牌、Retry-After剩餘等待秒數與成功/限流次數，
+    以及熔斷器狀態(連續失敗次數、是否暫停請求、恢復剩餘秒數)
+    """
+
+    return {"data": data_pipeline.rate_limiter.stats(), "circuits": data_pipeline.circuit_breaker.stats()}
+
+
+@app.get("/admin/dead_letters")
+# 回傳爬取失敗紀錄
+async def dead_letter_list():
+    """
+    取得歷史觀測資料爬取失敗的測站月份：測站代碼、月份、最後一次的錯誤訊息、累計失敗次數與最後失敗時間
+    - parked：累計失敗次數已達上限(預設5次)，每日更新不再自動重試，僅可手動重試
+    """
+
+    data = await sql_operate.run_async(data_pipeline.list_dead_letters)
+    return {"data": data}
+
+
+@app.put("/admin/dead_letters")
+# 重試爬取失敗的測站月份
+async def dead_letter_retry(include_parked: bool = True):
+    """
+    重新爬取失敗的測站月份，成功後刪除紀錄；每日的歷史資料更新也會自動重試先前月份(略過parked的紀錄)
+
+    - 輸入：
+        1. include_parked：是否包含已停止自動重試的紀錄(parked)，預設為true
+    - 於背景執行，立即回傳202，工作代碼見標頭X-Job-Id；重試進行中時重複請求會回傳同一個工作
+    """
+
+    job = backfill_runner.submit('history_retry', partial(
+        data_pipeline.retry_dead_letters, include_parked=include_parked))
+    return job_accepted(job)
+
+
+@app.get("/schedule")
+# 回傳排程狀態
+async def schedule_status():
+    """
+    取得定期更新排程的上次執行時間、工作代碼與下次執行時間
+    """
+
+    return {"data": [task.to_dict() for task in scheduler.tasks.values()]}
+
+
+@app.get("/jobs")
+# 回傳背景工作清單
+async def job_list():
+    """
+    取得所有背景工作(新到舊)
+    """
+
+    jobs = sorted(job_runner.list() + backfill_runner.list(), key=lambda job: job.created_at, reverse=True)
+    return {"data": [job.to_dict() for job in jobs]}
+
+
+@app.get("/jobs/{job_id}")
+# 回傳背景工作狀態
+async def job_status(job_id: str):
+    """
+    取得背景工作的狀態、進度、寫入筆數(新增與更新，未變動的筆數見rows_unchanged)與錯誤訊息(僅保留最近100則，總數見error_count)
+
+    - 輸入：
+    1. job_id：工作代碼
     """
 
-    data_pipeline.update_historical_data()
-    return {"message": "Refresh successful!"}
+    job = job_runner.get(job_id) or backfill_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='查無此工作')
+    return job.to_dict()
 
 
 @app.get("/history")
 # 回傳單一測站之歷史資料
-async def weather_historical_data(stn: str, start_date: int, end_date: int):
+async def weather_historical_data(request: Request, stn: str, start_date: int, end_date: int,
+                                  fields: Optional[str] = None,
+                                  limit: Optional[int] = Query(None, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+                                  after: Optional[int] = None,
+                                  format: Optional[str] = None, stream: Optional[str] = None,
+                                  orient: str = ORIENT_QUERY):
     """
     查詢所有觀測站指定期間內的觀測資料
 
@@ -77,41 +584,292 @@ async def weather_historical_data(stn: str, start_date: int, end_date: int):
     1. stn：觀測站代碼
     2. start_date：查詢起始日期(格式為時間戳)
     3. end_date：查詢結束日期(格式為時間戳)
+    4. format：回傳格式，可為json、ndjson、arrow、parquet、csv(亦可使用標頭Accept指定)
+    5. stream：設為ndjson時以NDJSON串流回傳(同format=ndjson)
+    6. orient：json的回傳形式，split(預設)為 {"columns": [...], "data": [[...]]}，records為逐筆物件
+    7. fields：回傳欄位(以逗號分隔)，可為 data_history 的任一欄位，obs_date 一律回傳；省略時為預設欄位
+    8. limit：分頁筆數(可省略，省略時回傳整個查詢期間)
+    9. after：分頁游標，填入上一頁回傳的 next，只回傳該日期之後的資料
+
+    - 分頁：json格式於 next 回傳下一頁的游標(無下一頁時為null)，其他格式則於標頭 X-Next-Cursor 回傳
     """
 
-    syntax = """
-        SELECT obs_date, Precp, WS, WSmax, Temperature, RH, UVImax
+    # 欄位名稱來自資料表模型的白名單，僅查詢條件使用參數綁定
+    if fields is None:
+        field_list = HISTORY_DEFAULT_FIELDS
+    else:
+        field_list = [field.strip() for field in fields.split(',') if field.strip()]
+        invalid_fields = [field for field in field_list if field not in HISTORY_FIELDS]
+        if len(invalid_fields) != 0:
+            raise HTTPException(
+                status_code=422, detail=f'fields 包含不存在的欄位：{", ".join(invalid_fields)}')
+        field_list = ['obs_date'] + [field for field in dict.fromkeys(field_list) if field != 'obs_date']
+
+    # 以主鍵(sID, obs_date)進行鍵集分頁：從游標之後繼續掃描，不需OFFSET
+    syntax = f"""
+        SELECT {', '.join(field_list)}
         FROM data_history
         WHERE sID = :stn
         AND obs_date BETWEEN :start AND :end
+        AND obs_date > :after
+        ORDER BY obs_date
+        LIMIT :limit
     """
     syntax_params = {
         'stn': stn,
         'start': start_date,
         'end': end_date,
+        'after': after if after is not None else start_date - 1,
+        'limit': -1,
     }
-    data = sql_operate.api_query(syntax, syntax_params)
-    return {"data": data}
+    return await cached_response(
+        request, ['data_history'],
+        lambda: query_response(request, syntax, syntax_params, format, stream, orient, page_size=limit))
 
 
-@app.get("/history_multi", response_description="開發中", deprecated=True)
+@app.get("/history/aggregate")
+# 回傳單一測站依時間單位彙整之歷史資料
+async def weather_historical_data_aggregate(request: Request, stn: str, start_date: int, end_date: int,
+                                            freq: str = 'month', stats: str = 'mean,min,max,sum',
+                                            format: Optional[str] = None, orient: str = ORIENT_QUERY):
+    """
+    查詢單一觀測站指定期間內，依時間單位彙整的觀測資料，每個區間回傳一筆
+
+    - 輸入：
+    1. stn：觀測站代碼
+    2. start_date：查詢起始日期(格式為時間戳)
+    3. end_date：查詢結束日期(格式為時間戳)
+    4. freq：時間單位，可為day、week、month、season、year
+    5. stats：統計方式(以逗號分隔)，可為mean、min、max、sum、count
+    6. format：回傳格式，可為json、ndjson、arrow、parquet、csv(亦可使用標頭Accept指定)
+    7. orient：json的回傳形式，split(預設)為 {"columns": [...], "data": [[...]]}，records為逐筆物件
+
+    - 輸出：obs_date為區間起始日期(時間戳)、days為區間內的資料筆數，其餘欄位名稱為「觀測項目_統計方式」
+    """
+
+    if freq not in AGGREGATE_FREQS:
+        raise HTTPException(
+            status_code=422, detail=f'freq 必須為 {", ".join(AGGREGATE_FREQS)} 之一')
+
+    stat_list = [stat.strip() for stat in stats.split(',') if stat.strip()]
+    invalid_stats = [stat for stat in stat_list if stat not in AGGREGATE_STATS]
+    if len(stat_list) == 0 or len(invalid_stats) != 0:
+        raise HTTPException(
+            status_code=422, detail=f'stats 必須為 {", ".join(AGGREGATE_STATS)} 的組合')
+
+    # 欄位與統計函式皆來自白名單，僅查詢條件使用參數綁定
+    select_columns = ',\n            '.join(
+        f'{AGGREGATE_STATS[stat]}({column}) AS {column}_{stat}'
+        for column in AGGREGATE_COLUMNS for stat in stat_list)
+    syntax = f"""
+        SELECT CAST(strftime('%s', bin) AS INTEGER) - 28800 AS obs_date,
+            COUNT(*) AS days,
+            {select_columns}
+        FROM (
+            SELECT {AGGREGATE_FREQS[freq]} AS bin, *
+            FROM data_history
+            WHERE sID = :stn
+            AND obs_date BETWEEN :start AND :end
+        )
+        GROUP BY bin
+        ORDER BY bin
+    """
+    syntax_params = {
+        'stn': stn,
+        'start': start_date,
+        'end': end_date,
+    }
+    return await cached_response(
+        request, ['data_history'],
+        lambda: query_response(request, syntax, syntax_params, format, orient=orient))
+
+
+@app.get("/history/snapshot")
+# 回傳單日所有測站之歷史資料
+async def weather_historical_data_snapshot(request: Request, date: int, fields: Optional[str] = None,
+                                           format: Optional[str] = None, orient: str = ORIENT_QUERY):
+    """
+    查詢指定日期所有觀測站的觀測資料，並附上觀測站經緯度，可用於繪製歷史天氣圖
+
+    - 輸入：
+    1. date：查詢日期(格式為時間戳，當日任一時間皆可)
+    2. fields：回傳的觀測項目(以逗號分隔)，可為 data_history 的觀測欄位；省略時為預設欄位
+    3. format：回傳格式，可為json、ndjson、arrow、parquet、csv(亦可使用標頭Accept指定)
+    4. orient：json的回傳形式，split(預設)為 {"columns": [...], "data": [[...]]}，records為逐筆物件
+
+    - 輸出：sID、stn_name、lon、lat、obs_date 與所選的觀測項目
+    """
+
+    if fields is None:
+        field_list = [field for field in HISTORY_DEFAULT_FIELDS if field != 'obs_date']
+    else:
+        field_list = list(dict.fromkeys(field.strip() for field in fields.split(',') if field.strip()))
+        invalid_fields = [field for field in field_list if field not in HISTORY_FIELDS]
+        if len(invalid_fields) != 0:
+            raise HTTPException(
+                status_code=422, detail=f'fields 包含不存在的欄位：{", ".join(invalid_fields)}')
+        field_list = [field for field in field_list if field not in ('sID', 'stn_name', 'obs_date')]
+
+    # 查詢臺灣時間當日的範圍：以日期索引(obs_date, stn_key)取得當日所有測站
+    day_start = date - (date + 28800) % 86400
+    syntax = f"""
+        SELECT h.sID, h.stn_name, s.lon, s.lat, h.obs_date{''.join(f', h.{field}' for field in field_list)}
+        FROM data_history h
+        JOIN station_list s ON s.sID = h.sID
+        WHERE h.obs_date BETWEEN :start AND :end
+        ORDER BY h.sID
+    """
+    syntax_params = {'start': day_start, 'end': day_start + 86399}
+    return await cached_response(
+        request, ['data_history', 'station_list'],
+        lambda: query_response(request, syntax, syntax_params, format, orient=orient))
+
+
+@app.get("/history/rollup")
+# 回傳單一測站之月、年彙整資料
+async def weather_historical_data_rollup(request: Request, stn: str, start_date: int, end_date: int,
+                                         freq: str = 'month', format: Optional[str] = None,
+                                         orient: str = ORIENT_QUERY):
+    """
+    查詢單一觀測站指定期間內的月或年彙整資料，直接讀取預先計算的彙整表，適用於長期趨勢
+
+    - 輸入：
+    1. stn：觀測站代碼
+    2. start_date：查詢起始日期(格式為時間戳)
+    3. end_date：查詢結束日期(格式為時間戳)
+    4. freq：時間單位，可為month、year
+    5. format：回傳格式，可為json、ndjson、arrow、parquet、csv(亦可使用標頭Accept指定)
+    6. orient：json的回傳形式，split(預設)為 {"columns": [...], "data": [[...]]}，records為逐筆物件
+
+    - 輸出：obs_date為區間起始日期(時間戳)，回傳與查詢期間重疊的所有區間(以整月、整年計算)；
+      days為資料天數、Temperature為平均氣溫、Tmax/Tmin為最高/最低氣溫、Precp為累積降雨量、
+      rain_days為雨日數(日降雨量≥0.1毫米)、RH為平均相對溼度、WS為平均風速、WSmax為最大瞬間風速
+    """
+
+    if freq not in ROLLUP_LEVELS:
+        raise HTTPException(
+            status_code=422, detail=f'freq 必須為 {", ".join(ROLLUP_LEVELS)} 之一')
+
+    # 以主鍵(sID, year[, month])的列值比較取得區間範圍
+    level = ROLLUP_LEVELS[freq]
+    key_columns = list(level['columns'])
+    start = datetime.datetime.fromtimestamp(start_date, TAIWAN_TZ)
+    end = datetime.datetime.fromtimestamp(end_date, TAIWAN_TZ)
+    syntax_params = {'stn': stn}
+    for column in key_columns:
+        syntax_params[f'start_{column}'] = getattr(start, column)
+        syntax_params[f'end_{column}'] = getattr(end, column)
+
+    syntax = f"""
+        SELECT CAST(strftime('%s', {ROLLUP_PERIOD_DATES[freq]}) AS INTEGER) - 28800 AS obs_date,
+            {', '.join(ROLLUP_COLUMNS)}
+        FROM {level['table']}
+        WHERE sID = :stn
+        AND ({', '.join(key_columns)}) >= ({', '.join(f':start_{column}' for column in key_columns)})
+        AND ({', '.join(key_columns)}) <= ({', '.join(f':end_{column}' for column in key_columns)})
+        ORDER BY {', '.join(key_columns)}
+    """
+    return await cached_response(
+        request, [level['table']],
+        lambda: query_response(request, syntax, syntax_params, format, orient=orient))
+
+
+@app.get("/history/range_stats")
+# 回傳單一測站任意期間的總和與平均
+async def weather_historical_data_range_stats(request: Request, stn: str, start_date: int, end_date: int,
+                                              fields: Optional[str] = None):
+    """
+    查詢單一觀測站指定期間內各觀測項目的總和、有效筆數與平均，由累計和計算，不需掃描期間內的每日資料
+
+    - 輸入：
+    1. stn：觀測站代碼
+    2. start_date：查詢起始日期(格式為時間戳)
+    3. end_date：查詢結束日期(格式為時間戳)
+    4. fields：觀測項目(以逗號分隔)，可為 PREFIX_COLUMNS 中的欄位；省略時為全部
+
+    - 輸出：days為期間內的資料天數；data為各觀測項目的 field、sum、count、mean(無有效資料時sum與mean為null)
+    """
+
+    if fields is None:
+        field_list = PREFIX_COLUMNS
+    else:
+        field_list = list(dict.fromkeys(field.strip() for field in fields.split(',') if field.strip()))
+        invalid_fields = [field for field in field_list if field not in PREFIX_COLUMNS]
+        if len(field_list) == 0 or len(invalid_fields) != 0:
+            raise HTTPException(
+                status_code=422, detail=f'fields 必須為 {", ".join(PREFIX_COLUMNS)} 的組合')
+    if start_date > end_date:
+        raise HTTPException(status_code=422, detail='start_date 不可大於 end_date')
+
+    # 期間統計 = 結束日期(含)以前的累計值 - 起始日期以前的累計值
+    async def build():
+        before = await sql_operate.async_api_query(
+            PREFIX_LOOKUP_SYNTAX, {'stn': stn, 'date': start_date - 1})
+        last = await sql_operate.async_api_query(
+            PREFIX_LOOKUP_SYNTAX, {'stn': stn, 'date': end_date})
+        days, data = range_stats(
+            before[0] if before else None, last[0] if last else None, field_list)
+        return {"days": days, "data": data}
+
+    return await cached_response(request, ['history_prefix'], build)
+
+
+@app.get("/history_multi")
 # 回傳多個測站之歷史資料
-async def weather_historical_data(stns: str, start: int, end: int):
+async def weather_historical_data_multi(request: Request, stns: str, start: int, end: int,
+                                        shape: str = 'grouped', format: Optional[str] = None):
     """
-    回傳多個測站之歷史資料
+    回傳多個測站之歷史資料，以單一查詢批次取得
 
+    - 輸入：
+    1. stns：觀測站代碼(以逗號分隔)
+    2. start：查詢起始日期(格式為時間戳)
+    3. end：查詢結束日期(格式為時間戳)
+    4. shape：json的回傳形式，grouped為依測站分組，matrix為日期×測站的對齊矩陣
+    5. format：回傳格式，可為json、ndjson、arrow、parquet、csv(亦可使用標頭Accept指定)；非json格式一律回傳含sID欄位的長表格
+
+    - 限制：測站數量 × 查詢天數不得超過 HISTORY_MULTI_MAX_CELLS
     """
 
-    syntax = """
-        SELECT obs_date, Precp, WD, WS, Temperature, RH, UVImax
+    # 整理測站代碼並去除重複
+    stn_list = list(dict.fromkeys(
+        stn.strip() for stn in stns.split(',') if stn.strip()))
+    if len(stn_list) == 0:
+        raise HTTPException(status_code=422, detail='stns 至少需包含一個測站代碼')
+    if shape not in ('grouped', 'matrix'):
+        raise HTTPException(
+            status_code=422, detail='shape 必須為 grouped 或 matrix')
+
+    # 限制查詢規模：測站數量 × 查詢天數
+    days = max((end - start) // 86400 + 1, 1)
+    if len(stn_list) * days > HISTORY_MULTI_MAX_CELLS:
+        raise HTTPException(
+            status_code=422, detail=f'查詢範圍過大：測站數量 × 查詢天數不得超過 {HISTORY_MULTI_MAX_CELLS}')
+
+    # 使用expanding參數展開IN條件，依主鍵(sID, obs_date)逐站範圍掃描
+    syntax = text("""
+        SELECT sID, obs_date, Precp, WD, WS, Temperature, RH, UVImax
         FROM data_history
         WHERE sID IN :stns
         AND obs_date BETWEEN :start AND :end
-    """
+        ORDER BY sID, obs_date
+    """).bindparams(bindparam('stns', expanding=True))
     syntax_params = {
-        'stns': stns,
+        'stns': stn_list,
         'start': start,
         'end': end,
     }
-    data = sql_operate.api_query(syntax, syntax_params)
-    return {"data": data}
+
+    async def build():
+        fmt = negotiate_format(request, format)
+        if fmt != 'json':
+            return await query_response(request, syntax, syntax_params, format)
+
+        column_names, rows = await sql_operate.async_api_query_rows(syntax, syntax_params)
+        if shape == 'matrix':
+            data = await sql_operate.run_async(to_station_matrix, column_names, rows, stn_list)
+        else:
+            data = await sql_operate.run_async(group_by_station, column_names, rows, stn_list)
+        return {"data": data}
+
+    return await cached_response(request, ['data_history'], build)
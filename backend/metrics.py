@@ -0,0 +1,175 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# 延遲時間分布的預設區間(秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Metric:
+    '''
+    監控指標基底類別：依標籤值分別記錄數值
+    '''
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}  # 標籤值(Tuple) -> 數值
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    # 依標籤名稱順序取得標籤值
+    def label_values(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    # 將標籤轉換為Prometheus文字格式
+    @staticmethod
+    def format_labels(names, values):
+        if len(names) == 0:
+            return ''
+        pairs = []
+        for name, value in zip(names, values):
+            value = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            pairs.append(f'{name}="{value}"')
+        return '{' + ','.join(pairs) + '}'
+
+    # 輸出Prometheus文字格式
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{self.format_labels(self.labelnames, label_values)} {value}')
+        return lines
+
+
+class Counter(Metric):
+    '''
+    計數器：只增不減的累計值
+    '''
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    '''
+    量測值：可增可減的目前數值
+    '''
+
+    type = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    '''
+    分布統計：記錄各區間的累計次數、總和與次數
+    '''
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    # 記錄一次觀測值：values內容為[各區間次數(非累計)..., 總和, 次數]
+    def observe(self, value, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = [0] * (len(self.buckets) + 2)
+                self.values[key] = state
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[idx] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    # 計時區塊：離開區塊時記錄經過的秒數
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        bucket_names = self.labelnames + ('le',)
+        with self.lock:
+            for label_values, state in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state):
+                    cumulative += count
+                    labels = self.format_labels(bucket_names, label_values + (repr(float(bound)),))
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = self.format_labels(bucket_names, label_values + ('+Inf',))
+                lines.append(f'{self.name}_bucket{labels} {state[-1]}')
+                labels = self.format_labels(self.labelnames, label_values)
+                lines.append(f'{self.name}_sum{labels} {state[-2]}')
+                lines.append(f'{self.name}_count{labels} {state[-1]}')
+        return lines
+
+
+REGISTRY = []  # 所有已建立的監控指標
+
+
+# 輸出所有監控指標的Prometheus文字格式
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# API監控指標
+HTTP_REQUESTS = Counter(
+    'weather_http_requests_total', 'API請求次數', ('method', 'route', 'status'))
+HTTP_REQUEST_SECONDS = Histogram(
+    'weather_http_request_duration_seconds', 'API請求處理時間(秒)', ('method', 'route'))
+HTTP_IN_FLIGHT = Gauge(
+    'weather_http_requests_in_flight', '處理中的API請求數量', ('method', 'route'))
+
+# 資料庫監控指標
+SQL_SECONDS = Histogram(
+    'weather_sql_duration_seconds', '資料庫操作時間(秒)', ('operation',))
+SQL_ROWS = Counter(
+    'weather_sql_rows_total', '資料庫操作的資料筆數', ('operation',))
+
+# 資料處理管線監控指標
+ETL_STAGE_SECONDS = Histogram(
+    'weather_etl_stage_duration_seconds', '資料處理各階段時間(秒)', ('task', 'stage'),
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600, 7200))
+CRAWLER_REQUESTS = Counter(
+    'weather_crawler_requests_total', '爬蟲請求次數', ('host', 'status'))
+CRAWLER_RETRIES = Counter(
+    'weather_crawler_retries_total', '爬蟲重試次數', ('host',))
+CRAWLER_BYTES = Counter(
+    'weather_crawler_bytes_total', '爬蟲下載位元組數', ('host',))
+CRAWLER_RATE = Gauge(
+    'weather_crawler_rate', '爬蟲目前的請求速率上限(每秒請求數)', ('host',))
+CRAWLER_THROTTLED = Counter(
+    'weather_crawler_throttled_total', '爬蟲遭限流或異常而降速的次數', ('host', 'reason'))
+CRAWLER_CIRCUIT_OPEN = Gauge(
+    'weather_crawler_circuit_open', '爬蟲熔斷器狀態(1為暫停請求中)', ('host',))
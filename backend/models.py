@@ -6,6 +6,7 @@ Base = declarative_base()
 metadata = Base.metadata
 
 
+# data_history 為檢視表：由 history_compact 以 station_key 對應測站代碼，並由 station_list 帶入測站名稱
 class DataHistory(Base):
     __tablename__ = 'data_history'
 
@@ -32,6 +33,38 @@ class DataHistory(Base):
     CloudAmount = Column(Float)
 
 
+class StationKey(Base):
+    __tablename__ = 'station_key'
+
+    stn_key = Column(Integer, primary_key=True)
+    sID = Column(Text, unique=True, nullable=False)
+
+
+class HistoryCompact(Base):
+    __tablename__ = 'history_compact'
+
+    stn_key = Column(Integer, primary_key=True)
+    obs_date = Column(Integer, primary_key=True)
+    StnPres = Column(Float)
+    SeaPres = Column(Float)
+    Temperature = Column(Float)
+    Tmax = Column(Float)
+    Tmin = Column(Float)
+    RH = Column(Float)
+    WS = Column(Float)
+    WD = Column(Integer)
+    WSmax = Column(Float)
+    WDmax = Column(Integer)
+    Precp = Column(Float)
+    PrecpHour = Column(Float)
+    SunShineHour = Column(Float)
+    SunshineRate = Column(Float)
+    GloblRad = Column(Float)
+    VisbMean = Column(Float)
+    UVImax = Column(Float)
+    CloudAmount = Column(Float)
+
+
 class DataRealtime(Base):
     __tablename__ = 'data_realtime'
 
@@ -46,6 +79,35 @@ class DataRealtime(Base):
     UVI = Column(Float)
 
 
+class RealtimeSeries(Base):
+    __tablename__ = 'realtime_series'
+
+    sID = Column(Text, primary_key=True)
+    obs_time = Column(Integer, primary_key=True)
+    Precp = Column(Float)
+    WD = Column(Float)
+    WS = Column(Float)
+    Temperature = Column(Float)
+    RH = Column(Integer)
+    UVI = Column(Float)
+
+
+class RealtimeHourly(Base):
+    __tablename__ = 'realtime_hourly'
+
+    sID = Column(Text, primary_key=True)
+    obs_time = Column(Integer, primary_key=True)
+    samples = Column(Integer)
+    Precp = Column(Float)
+    Temperature = Column(Float)
+    Tmax = Column(Float)
+    Tmin = Column(Float)
+    RH = Column(Float)
+    WS = Column(Float)
+    WSmax = Column(Float)
+    UVI = Column(Float)
+
+
 class StationList(Base):
     __tablename__ = 'station_list'
 
@@ -60,3 +122,66 @@ class StationList(Base):
     end_date = Column(Text)
     remark = Column(Text)
     state = Column(Integer)
+
+
+class ScheduleState(Base):
+    __tablename__ = 'schedule_state'
+
+    name = Column(Text, primary_key=True)
+    last_run = Column(Integer)
+    last_job_id = Column(Text)
+
+
+# 爬取失敗的測站月份：供之後的資料更新重試
+class FetchDeadLetter(Base):
+    __tablename__ = 'fetch_dead_letter'
+
+    sID = Column(Text, primary_key=True)
+    month = Column(Text, primary_key=True)
+    error = Column(Text)
+    attempts = Column(Integer)
+    failed_at = Column(Integer)
+
+
+# 歷史資料回補的工作清單：每個測站月份一筆，status為pending、done或failed
+class BackfillManifest(Base):
+    __tablename__ = 'backfill_manifest'
+
+    sID = Column(Text, primary_key=True)
+    month = Column(Text, primary_key=True)
+    status = Column(Text)
+    rows = Column(Integer)
+    fetched_at = Column(Integer)
+
+
+class RollupMonthly(Base):
+    __tablename__ = 'rollup_monthly'
+
+    sID = Column(Text, primary_key=True)
+    year = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    days = Column(Integer)
+    Temperature = Column(Float)
+    Tmax = Column(Float)
+    Tmin = Column(Float)
+    Precp = Column(Float)
+    rain_days = Column(Integer)
+    RH = Column(Float)
+    WS = Column(Float)
+    WSmax = Column(Float)
+
+
+class RollupYearly(Base):
+    __tablename__ = 'rollup_yearly'
+
+    sID = Column(Text, primary_key=True)
+    year = Column(Integer, primary_key=True)
+    days = Column(Integer)
+    Temperature = Column(Float)
+    Tmax = Column(Float)
+    Tmin = Column(Float)
+    Precp = Column(Float)
+    rain_days = Column(Integer)
+    RH = Column(Float)
+    WS = Column(Float)
+    WSmax = Column(Float)
@@ -0,0 +1,71 @@
+# 歷史觀測資料請求規劃：依資料庫已有的日期，規劃補齊缺漏所需的最少 (測站, 期間) 請求
+# CODIS 的 report_month 請求以月份為單位(date為月份)，單次請求最多涵蓋同一個月份內的任意期間
+import re
+import datetime
+
+
+# 將測站的設站、撤站日期轉換為datetime.date：無日期或無法解析時回傳None
+def station_date(value):
+    match = re.match(r'(\d{4})\D(\d{1,2})\D(\d{1,2})', value or '')
+    if match is None:
+        return None
+    try:
+        return datetime.date(int(match[1]), int(match[2]), int(match[3]))
+    except ValueError:
+        return None
+
+
+# 測站在期間內的運作範圍：依設站與撤站日期裁切 [start, end]，撤站日期早於期間或設站日期晚於期間時回傳None
+def station_span(station, start, end):
+    first = max(start, station_date(station.get('start_date')) or start)
+    last = min(end, station_date(station.get('end_date')) or end)
+    if first > last:
+        return None
+    return first, last
+
+
+# 將期間依月份切分：回傳 [(月份第一天或first, 月份最後一天或last), ...]
+def month_windows(first, last):
+    windows = []
+    while first <= last:
+        next_month = (first.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+        windows.append((first, min(last, next_month - datetime.timedelta(days=1))))
+        first = next_month
+    return windows
+
+
+# 期間內的缺漏範圍：covered為已有資料的日期集合，回傳涵蓋所有缺漏日期的 (第一個缺漏日, 最後一個缺漏日)，無缺漏時回傳None
+def missing_window(covered, first, last):
+    missing_first = None
+    missing_last = None
+    day = first
+    while day <= last:
+        if day not in covered:
+            missing_first = missing_first or day
+            missing_last = day
+        day += datetime.timedelta(days=1)
+
+    if missing_first is None:
+        return None
+    return missing_first, missing_last
+
+
+# 規劃請求：stations為測站清單(含sID、stn_name、start_date、end_date)，coverage為 {測站代碼: 已有資料的日期集合}
+# 每個測站月份有缺漏時發送一次請求，範圍由第一個缺漏日至最後一個缺漏日
+# 回傳List of Dict {sID, stn_name, start, end}，依月份、測站代碼排序
+def plan_requests(stations, coverage, start, end):
+    plan = []
+    for station in stations:
+        span = station_span(station, start, end)
+        if span is None:
+            continue
+
+        covered = coverage.get(station['sID'], set())
+        for first, last in month_windows(*span):
+            window = missing_window(covered, first, last)
+            if window is not None:
+                plan.append({'sID': station['sID'], 'stn_name': station['stn_name'],
+                             'start': window[0], 'end': window[1]})
+
+    plan.sort(key=lambda item: (item['start'].replace(day=1), item['sID']))
+    return plan
@@ -0,0 +1,102 @@
+# 累計和：data_history 各測站依 obs_date 累計的總和與筆數，任意期間的總和與平均只需查詢起訖兩筆
+
+PREFIX_TABLE = 'history_prefix'
+
+# 累計的觀測項目
+PREFIX_COLUMNS = ['Precp', 'PrecpHour', 'Temperature', 'Tmax', 'Tmin', 'RH', 'WS', 'SunShineHour', 'GloblRad']
+
+
+# 建立累計和資料表的SQL語法：每筆為該測站至 obs_date(含)為止的資料天數，以及各觀測項目的總和與有效筆數
+def create_prefix_syntax():
+    column_definitions = ''.join(
+        f'\n            "{column}_sum"\tREAL, -- {column}累計總和'
+        f'\n            "{column}_count"\tINTEGER, -- {column}累計有效筆數'
+        for column in PREFIX_COLUMNS)
+    return f"""
+        CREATE TABLE IF NOT EXISTS "{PREFIX_TABLE}" (
+            "sID"	TEXT, -- 測站代碼
+            "obs_date"	INTEGER, -- 資料日期
+            "days"	INTEGER, -- 累計資料天數{column_definitions}
+            PRIMARY KEY("sID","obs_date")
+        ) WITHOUT ROWID;
+    """
+
+
+# 重新計算累計和的SQL語法：source須包含sID與obs_date，各測站自其最早的日期起重算至最後一筆
+# 起點之前的累計值取自既有的前一筆，其後以視窗函式累加
+def refresh_prefix_syntax(source):
+    select_columns = ''.join(
+        f',\n            COALESCE(p."{column}_sum", 0) + TOTAL(h."{column}") OVER w'
+        f',\n            COALESCE(p."{column}_count", 0) + COUNT(h."{column}") OVER w'
+        for column in PREFIX_COLUMNS)
+    insert_columns = ', '.join(
+        f'"{column}_{suffix}"' for column in PREFIX_COLUMNS for suffix in ('sum', 'count'))
+    return f"""
+        INSERT OR REPLACE INTO "{PREFIX_TABLE}" (sID, obs_date, days, {insert_columns})
+        SELECT h.sID, h.obs_date,
+            COALESCE(p.days, 0) + COUNT(*) OVER w{select_columns}
+        FROM (
+            SELECT s.sID, s.since, (
+                SELECT MAX(obs_date) FROM "{PREFIX_TABLE}"
+                WHERE sID = s.sID AND obs_date < s.since
+            ) AS base_date
+            FROM (
+                SELECT sID, MIN(obs_date) AS since
+                FROM {source}
+                GROUP BY sID
+            ) s
+        ) t
+        JOIN data_history h
+        ON h.sID = t.sID AND h.obs_date >= t.since
+        LEFT JOIN "{PREFIX_TABLE}" p
+        ON p.sID = t.sID AND p.obs_date = t.base_date
+        WINDOW w AS (PARTITION BY h.sID ORDER BY h.obs_date ROWS UNBOUNDED PRECEDING)
+    """
+
+
+# 增量更新：source為寫入批次的資料來源(須包含sID與obs_date)，重算涉及測站的累計和，回傳異動的資料表名稱
+# 每日更新僅涉及最近的日期，重算筆數很少；補齊舊資料時則會重算該測站其後的所有日期
+def refresh_prefix_sums(connection, source):
+    connection.exec_driver_sql(create_prefix_syntax())
+    connection.exec_driver_sql(refresh_prefix_syntax(source))
+    return [PREFIX_TABLE]
+
+
+# 由 data_history 重建所有累計和，用於首次建立資料表或修復資料，回傳異動的資料表名稱
+def rebuild_prefix_sums(connection):
+    connection.exec_driver_sql(create_prefix_syntax())
+    connection.exec_driver_sql(f'DELETE FROM "{PREFIX_TABLE}"')
+    connection.exec_driver_sql(refresh_prefix_syntax('data_history'))
+    return [PREFIX_TABLE]
+
+
+# 查詢累計值的SQL語法：取得測站於 :date (含)以前的最後一筆累計值，以主鍵反向查找一筆
+PREFIX_LOOKUP_SYNTAX = f"""
+    SELECT *
+    FROM "{PREFIX_TABLE}"
+    WHERE sID = :stn
+    AND obs_date <= :date
+    ORDER BY obs_date DESC
+    LIMIT 1
+"""
+
+
+# 由期間起訖的累計值計算期間統計：before為起始日期前一筆(可為None)、last為結束日期(含)以前最後一筆
+# 回傳 (資料天數, List of Dict {field, sum, count, mean})
+def range_stats(before, last, fields):
+    before = before or {}
+    last = last or {}
+    days = (last.get('days') or 0) - (before.get('days') or 0)
+
+    stats = []
+    for field in fields:
+        total = (last.get(f'{field}_sum') or 0) - (before.get(f'{field}_sum') or 0)
+        count = (last.get(f'{field}_count') or 0) - (before.get(f'{field}_count') or 0)
+        stats.append({
+            'field': field,
+            'sum': total if count != 0 else None,
+            'count': count,
+            'mean': total / count if count != 0 else None,
+        })
+
+    return days, stats
@@ -0,0 +1,136 @@
+import time
+import asyncio
+import datetime
+import threading
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from .metrics import CRAWLER_RATE, CRAWLER_THROTTLED
+
+
+@dataclass
+class RateBudget:
+    '''
+    主機的請求速率設定(每秒請求數)：由initial_rate開始，在min_rate與max_rate之間調整，burst為可累積的令牌數
+    '''
+
+    initial_rate: float = 1.0
+    min_rate: float = 0.1
+    max_rate: float = 8.0
+    burst: float = 2.0
+
+
+class TokenBucket:
+    '''
+    單一主機的令牌桶與統計
+    '''
+
+    def __init__(self, budget) -> None:
+        self.budget = budget
+        self.rate = budget.initial_rate
+        self.tokens = budget.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # 依Retry-After暫停至此時間(monotonic)
+        self.successes = 0
+        self.throttled = 0
+
+    # 依經過時間補充令牌
+    def refill(self, now):
+        self.tokens = min(self.budget.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class AdaptiveRateLimiter:
+    '''
+    自適應速率控制：每個主機一個令牌桶，速率以AIMD調整
+    - 成功回應(200)：速率加上increase(加法增加)
+    - 429、5xx或逾時：速率乘上decrease(乘法減少)，並遵守Retry-After
+    '''
+
+    # default_budget：未指定主機的速率設定；budgets：{主機名稱: RateBudget}
+    def __init__(self, default_budget=None, budgets=None, increase=0.05, decrease=0.5) -> None:
+        self.default_budget = default_budget or RateBudget()
+        self.budgets = budgets or {}
+        self.increase = increase
+        self.decrease = decrease
+        self.buckets = {}  # 主機名稱 -> TokenBucket
+        self.lock = threading.Lock()  # 速率狀態跨資料更新保留，可能由不同執行緒的事件迴圈存取
+
+    # 取得主機的令牌桶
+    def __bucket(self, host):
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            bucket = TokenBucket(self.budgets.get(host, self.default_budget))
+            self.buckets[host] = bucket
+            CRAWLER_RATE.set(bucket.rate, host=host)
+        return bucket
+
+    # 取得發送請求的許可：先預扣一個令牌，令牌不足或暫停中時等待至可發送的時間
+    async def acquire(self, host):
+        with self.lock:
+            bucket = self.__bucket(host)
+            now = time.monotonic()
+            bucket.refill(now)
+            bucket.tokens -= 1
+            wait = -bucket.tokens / bucket.rate if bucket.tokens < 0 else 0
+            wait = max(wait, bucket.blocked_until - now)
+
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    # 成功回應：加法增加速率
+    def on_success(self, host):
+        with self.lock:
+            bucket = self.__bucket(host)
+            bucket.successes += 1
+            self.__set_rate(host, bucket, min(bucket.rate + self.increase, bucket.budget.max_rate))
+
+    # 伺服器限流或異常：乘法減少速率；retry_after(秒)為伺服器要求的等待時間，期間不發送請求
+    def on_throttle(self, host, reason, retry_after=None):
+        with self.lock:
+            bucket = self.__bucket(host)
+            bucket.throttled += 1
+            now = time.monotonic()
+            bucket.refill(now)
+            self.__set_rate(host, bucket, max(bucket.rate * self.decrease, bucket.budget.min_rate))
+            if retry_after is not None and retry_after > 0:
+                bucket.blocked_until = max(bucket.blocked_until, now + retry_after)
+                bucket.tokens = min(bucket.tokens, 0)
+
+        CRAWLER_THROTTLED.inc(host=host, reason=reason)
+
+    # 更新速率，並同步至監控指標
+    @staticmethod
+    def __set_rate(host, bucket, rate):
+        bucket.rate = rate
+        CRAWLER_RATE.set(rate, host=host)
+
+    # 取得各主機目前的速率與統計：回傳List of Dict
+    def stats(self):
+        with self.lock:
+            now = time.monotonic()
+            return [{
+                'host': host,
+                'rate': round(bucket.rate, 4),
+                'min_rate': bucket.budget.min_rate,
+                'max_rate': bucket.budget.max_rate,
+                'tokens': round(min(bucket.budget.burst, bucket.tokens + (now - bucket.updated) * bucket.rate), 4),
+                'blocked_seconds': round(max(bucket.blocked_until - now, 0), 3),
+                'successes': bucket.successes,
+                'throttled': bucket.throttled,
+            } for host, bucket in self.buckets.items()]
+
+
+# 解析Retry-After標頭：可為秒數或HTTP日期，回傳等待秒數；無法解析時回傳None
+def parse_retry_after(value):
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max((retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0)
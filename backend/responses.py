@@ -0,0 +1,132 @@
+import io
+import csv
+import json
+from typing import Optional
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+# orjson為選用套件：未安裝時，改用標準函式庫json序列化
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# pyarrow為選用套件：未安裝時，Arrow/Parquet請求改以CSV回傳
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+# 各輸出格式對應的MIME類型
+MEDIA_TYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+    'csv': 'text/csv',
+}
+
+# 標頭Accept可接受的MIME類型與輸出格式對照
+ACCEPT_FORMATS = {
+    'application/x-ndjson': 'ndjson',
+    'application/vnd.apache.arrow.stream': 'arrow',
+    'application/vnd.apache.parquet': 'parquet',
+    'application/x-parquet': 'parquet',
+    'text/csv': 'csv',
+}
+
+
+# 序列化為JSON位元組：優先使用orjson
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONResponse(Response):
+    '''
+    JSON回應：內容直接序列化為位元組，不經過jsonable_encoder
+    '''
+
+    media_type = 'application/json'
+
+    def render(self, content):
+        return dumps(content)
+
+
+# 將查詢結果(欄位名稱、資料列)序列化為JSON回應
+# orient為split時回傳 {"columns": [...], "data": [[...], ...]}，資料列直接序列化；為records時回傳 {"data": [{欄位: 值}, ...]}
+# paginated為True時(分頁查詢)，另外回傳 {"next": 下一頁游標}
+def json_response(column_names, rows, orient='split', paginated=False, next_cursor=None):
+    if orient == 'split':
+        content = {'columns': column_names, 'data': rows}
+    else:
+        content = {'data': [dict(zip(column_names, row)) for row in rows]}
+
+    if paginated:
+        content['next'] = next_cursor
+    return FastJSONResponse(content)
+
+
+# 決定回傳格式：優先採用查詢參數format(或舊版的stream)，其次依標頭Accept判斷，預設為json
+def negotiate_format(request: Request, format: Optional[str] = None, stream: Optional[str] = None):
+    requested = format or stream
+    if requested is not None:
+        requested = requested.lower()
+        if requested not in MEDIA_TYPES:
+            requested = 'json'
+    else:
+        requested = 'json'
+        accept = request.headers.get('accept', '')
+        for media_type in accept.split(','):
+            media_type = media_type.split(';')[0].strip().lower()
+            if media_type in ACCEPT_FORMATS:
+                requested = ACCEPT_FORMATS[media_type]
+                break
+
+    # 未安裝pyarrow時，列式格式改以CSV回傳
+    if requested in ('arrow', 'parquet') and pa is None:
+        requested = 'csv'
+
+    return requested
+
+
+# 以NDJSON格式串流回傳查詢結果：輸入逐批產生List of Dict的迭代器，每筆資料一行JSON
+def ndjson_response(chunks):
+    def generate():
+        for rows in chunks:
+            yield b''.join(dumps(row) + b'\n' for row in rows)
+
+    return StreamingResponse(generate(), media_type=MEDIA_TYPES['ndjson'])
+
+
+# 將欄位名稱與資料列轉換為Arrow表格
+def to_arrow_table(column_names, rows):
+    columns = list(zip(*rows)) if rows else [[] for _ in column_names]
+    return pa.table({name: list(values) for name, values in zip(column_names, columns)})
+
+
+# 以列式格式(Arrow IPC串流/Parquet/CSV)回傳查詢結果：輸入欄位名稱、資料列(List of Tuple)與格式
+def tabular_response(column_names, rows, fmt):
+    buffer = io.BytesIO()
+
+    if fmt == 'arrow':
+        table = to_arrow_table(column_names, rows)
+        with pa.ipc.new_stream(buffer, table.schema) as writer:
+            writer.write_table(table)
+
+    elif fmt == 'parquet':
+        table = to_arrow_table(column_names, rows)
+        pa.parquet.write_table(table, buffer)
+
+    else:
+        text_buffer = io.TextIOWrapper(buffer, encoding='utf-8', newline='')
+        writer = csv.writer(text_buffer)
+        writer.writerow(column_names)
+        writer.writerows(rows)
+        text_buffer.detach()
+        fmt = 'csv'
+
+    return Response(content=buffer.getvalue(), media_type=MEDIA_TYPES[fmt])
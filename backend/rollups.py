@@ -0,0 +1,108 @@
+# 彙整表：data_history 依測站與月份、年份預先計算的統計值，長期趨勢直接讀取，不需重新掃描每日資料
+
+# 各時間單位的彙整表設定：資料表名稱、時間欄位(皆為臺灣時間UTC+8)與區間起訖的日期修飾詞
+ROLLUP_LEVELS = {
+    'month': {
+        'table': 'rollup_monthly',
+        'columns': {
+            'year': "CAST(strftime('%Y', obs_date + 28800, 'unixepoch') AS INTEGER)",
+            'month': "CAST(strftime('%m', obs_date + 28800, 'unixepoch') AS INTEGER)",
+        },
+        'start_of': 'start of month',
+        'step': '+1 month',
+    },
+    'year': {
+        'table': 'rollup_yearly',
+        'columns': {
+            'year': "CAST(strftime('%Y', obs_date + 28800, 'unixepoch') AS INTEGER)",
+        },
+        'start_of': 'start of year',
+        'step': '+1 year',
+    },
+}
+
+# 彙整表主鍵欄位的型別與說明
+ROLLUP_KEYS = {
+    'sID': 'TEXT, -- 測站代碼',
+    'year': 'INTEGER, -- 年(臺灣時間)',
+    'month': 'INTEGER, -- 月(臺灣時間)',
+}
+
+# 彙整欄位與對應的SQL運算式：雨日為日降雨量達0.1毫米(不含雨跡)的天數
+ROLLUP_COLUMNS = {
+    'days': 'COUNT(*)',
+    'Temperature': 'AVG(h.Temperature)',
+    'Tmax': 'MAX(h.Tmax)',
+    'Tmin': 'MIN(h.Tmin)',
+    'Precp': 'SUM(h.Precp)',
+    'rain_days': 'SUM(h.Precp >= 0.1)',
+    'RH': 'AVG(h.RH)',
+    'WS': 'AVG(h.WS)',
+    'WSmax': 'MAX(h.WSmax)',
+}
+
+
+# 建立彙整表的SQL語法
+def create_rollup_syntax(freq):
+    level = ROLLUP_LEVELS[freq]
+    key_columns = ['sID'] + list(level['columns'])
+    key_definitions = ''.join(
+        f'\n            "{column}"\t{ROLLUP_KEYS[column]}' for column in key_columns)
+    return f"""
+        CREATE TABLE IF NOT EXISTS "{level['table']}" ({key_definitions}
+            "days"	INTEGER, -- 資料天數
+            "Temperature"	REAL, -- 平均氣溫
+            "Tmax"	REAL, -- 最高氣溫
+            "Tmin"	REAL, -- 最低氣溫
+            "Precp"	REAL, -- 累積降雨量
+            "rain_days"	INTEGER, -- 雨日數(日降雨量≥0.1毫米)
+            "RH"	REAL, -- 平均相對溼度
+            "WS"	REAL, -- 平均風速
+            "WSmax"	REAL, -- 最大瞬間風速
+            PRIMARY KEY({', '.join(f'"{column}"' for column in key_columns)})
+        );
+    """
+
+
+# 重新計算彙整值的SQL語法：source為涵蓋的資料來源(須包含sID與obs_date)，僅重算其涉及的測站與區間
+# 每個區間以主鍵(sID, obs_date)範圍讀取 data_history
+def refresh_rollup_syntax(freq, source):
+    level = ROLLUP_LEVELS[freq]
+    period_columns = ', '.join(f'{expr} AS {column}' for column, expr in level['columns'].items())
+    key_columns = ', '.join(f'p.{column}' for column in level['columns'])
+    local_time = "obs_date + 28800, 'unixepoch'"
+    return f"""
+        INSERT OR REPLACE INTO "{level['table']}" (sID, {', '.join(level['columns'])}, {', '.join(ROLLUP_COLUMNS)})
+        SELECT p.sID, {key_columns},
+            {', '.join(ROLLUP_COLUMNS.values())}
+        FROM (
+            SELECT DISTINCT sID, {period_columns},
+                CAST(strftime('%s', {local_time}, '{level['start_of']}') AS INTEGER) - 28800 AS period_start,
+                CAST(strftime('%s', {local_time}, '{level['start_of']}', '{level['step']}') AS INTEGER) - 28800 AS period_end
+            FROM {source}
+        ) p
+        JOIN data_history h
+        ON h.sID = p.sID AND h.obs_date >= p.period_start AND h.obs_date < p.period_end
+        GROUP BY p.sID, {key_columns}
+    """
+
+
+# 增量更新：source為寫入批次的資料來源(須包含sID與obs_date)，僅重算涉及的測站月份與年份，回傳異動的彙整表名稱
+def refresh_rollups(connection, source):
+    tables = []
+    for freq, level in ROLLUP_LEVELS.items():
+        connection.exec_driver_sql(create_rollup_syntax(freq))
+        connection.exec_driver_sql(refresh_rollup_syntax(freq, source))
+        tables.append(level['table'])
+    return tables
+
+
+# 由 data_history 重建所有彙整值，用於首次建立彙整表或修復資料，回傳異動的彙整表名稱
+def rebuild_rollups(connection):
+    tables = []
+    for freq, level in ROLLUP_LEVELS.items():
+        connection.exec_driver_sql(create_rollup_syntax(freq))
+        connection.exec_driver_sql(f'DELETE FROM "{level["table"]}"')
+        connection.exec_driver_sql(refresh_rollup_syntax(freq, 'data_history'))
+        tables.append(level['table'])
+    return tables
@@ -0,0 +1,128 @@
+import time
+import random
+import asyncio
+from .models import ScheduleState
+
+
+class ScheduledTask:
+    '''
+    排程工作：每隔interval秒、於對齊時間點加上offset秒執行，並加入0~jitter秒的隨機延遲
+    '''
+
+    def __init__(self, name, func, interval, offset=0, jitter=0) -> None:
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.offset = offset
+        self.jitter = jitter
+        self.last_run = None  # 上次執行的排程時間點(時間戳)
+        self.last_job_id = None
+        self.next_run = None  # 下次執行時間(時間戳，已含隨機延遲)
+
+    # 取得不晚於now的最近一個排程時間點
+    def previous_slot(self, now):
+        return (now - self.offset) // self.interval * self.interval + self.offset
+
+    # 計算下次執行時間
+    def schedule_next(self, now):
+        slot = self.previous_slot(now) + self.interval
+        self.next_run = slot + random.uniform(0, self.jitter)
+
+    # 轉換為Dict，供API回傳
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'interval': self.interval,
+            'last_run': self.last_run,
+            'last_job_id': self.last_job_id,
+            'next_run': self.next_run,
+        }
+
+
+class Scheduler:
+    '''
+    排程器：於背景定期提交資料更新工作，並將上次執行時間寫入資料庫
+    '''
+
+    def __init__(self, job_runner, sql_operate) -> None:
+        self.job_runner = job_runner
+        self.sql_operate = sql_operate
+        self.tasks = {}
+        self.loop_task = None
+
+    # 新增排程工作
+    def add(self, name, func, interval, offset=0, jitter=0):
+        self.tasks[name] = ScheduledTask(name, func, interval, offset, jitter)
+
+    # 建立排程狀態表
+    def build_schedule_state_table(self):
+        syntax = """
+            CREATE TABLE IF NOT EXISTS "schedule_state" (
+                "name"	TEXT, -- 排程名稱
+                "last_run"	INTEGER, -- 上次執行的排程時間
+                "last_job_id"	TEXT, -- 上次執行的工作代碼
+                PRIMARY KEY("name")
+            );
+        """
+        self.sql_operate.create_table(syntax)
+
+    # 讀取上次執行狀態
+    def load_state(self):
+        syntax = """
+            SELECT name, last_run, last_job_id
+            FROM schedule_state
+        """
+        for item in self.sql_operate.query(syntax):
+            task = self.tasks.get(item['name'])
+            if task is not None:
+                task.last_run = item['last_run']
+                task.last_job_id = item['last_job_id']
+
+    # 寫入執行狀態
+    def save_state(self, task):
+        self.sql_operate.upsert(ScheduleState, [{
+            'name': task.name,
+            'last_run': task.last_run,
+            'last_job_id': task.last_job_id,
+        }])
+
+    # 啟動排程：讀取上次執行狀態，錯過的排程立即補執行
+    async def start(self):
+        await self.sql_operate.run_async(self.build_schedule_state_table)
+        await self.sql_operate.run_async(self.load_state)
+
+        now = time.time()
+        for task in self.tasks.values():
+            if task.last_run is None or task.last_run < task.previous_slot(now):
+                task.next_run = now + random.uniform(0, task.jitter)
+            else:
+                task.schedule_next(now)
+
+        self.loop_task = asyncio.create_task(self.__run())
+
+    # 停止排程
+    async def stop(self):
+        if self.loop_task is not None:
+            self.loop_task.cancel()
+            try:
+                await self.loop_task
+            except asyncio.CancelledError:
+                pass
+            self.loop_task = None
+
+    # 排程迴圈：等待最近的排程時間並提交工作；同名工作仍在執行時不重複提交
+    async def __run(self):
+        while True:
+            task = min(self.tasks.values(), key=lambda item: item.next_run)
+            await asyncio.sleep(max(task.next_run - time.time(), 0))
+
+            now = time.time()
+            job = self.job_runner.submit(task.name, task.func)
+            task.last_run = int(task.previous_slot(now))
+            task.last_job_id = job.id
+            task.schedule_next(now)
+
+            try:
+                await self.sql_operate.run_async(self.save_state, task)
+            except Exception as e:
+                print(f'排程狀態寫入失敗：{e}')
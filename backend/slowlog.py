@@ -0,0 +1,51 @@
+import time
+import threading
+from collections import deque
+
+
+class SlowQueryLog:
+    '''
+    慢查詢紀錄：保留最近max_entries筆執行時間超過threshold秒的查詢
+    '''
+
+    def __init__(self, threshold, max_entries=200) -> None:
+        self.threshold = threshold
+        self.entries = deque(maxlen=max_entries)  # 超過上限時自動淘汰最舊的紀錄
+        self.total = 0  # 累計的慢查詢次數(含已淘汰的紀錄)
+        self.lock = threading.Lock()
+
+    # 新增一筆慢查詢紀錄：seconds為總時間(含等待連線)，wait_seconds為等待取得連線的時間
+    def record(self, operation, sql, params, rows, seconds, plan, wait_seconds=0):
+        entry = {
+            'time': time.time(),
+            'operation': operation,
+            'seconds': round(seconds, 6),
+            'wait_seconds': round(wait_seconds, 6),
+            'rows': rows,
+            'sql': sql,
+            'params': params,
+            'plan': plan,
+        }
+        with self.lock:
+            self.entries.append(entry)
+            self.total += 1
+
+    # 取得所有紀錄(新到舊)
+    def list(self):
+        with self.lock:
+            return list(reversed(self.entries))
+
+    # 清除所有紀錄
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# 將EXPLAIN QUERY PLAN的結果(id, parent, notused, detail)依階層縮排為文字清單
+def format_query_plan(rows):
+    depth = {0: -1}
+    lines = []
+    for plan_id, parent, _, detail in rows:
+        depth[plan_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[plan_id] + detail)
+    return lines
@@ -0,0 +1,149 @@
+import math
+import heapq
+import threading
+
+EARTH_RADIUS_KM = 6371.0088  # 地球平均半徑(公里)
+
+
+class KDTree:
+    '''
+    k-d樹：輸入座標點(List of Tuple)與對應資料，提供最近鄰與矩形範圍查詢
+    '''
+
+    def __init__(self, points, items) -> None:
+        self.dims = len(points[0]) if len(points) != 0 else 0
+        self.root = self.__build(list(zip(points, items)), 0)
+
+    # 遞迴建立節點：依當層座標軸取中位數切分，節點格式為(座標, 資料, 座標軸, 左子樹, 右子樹)
+    def __build(self, entries, depth):
+        if len(entries) == 0:
+            return None
+
+        axis = depth % self.dims
+        entries.sort(key=lambda entry: entry[0][axis])
+        median = len(entries) // 2
+        point, item = entries[median]
+
+        return (point, item, axis,
+                self.__build(entries[:median], depth + 1),
+                self.__build(entries[median + 1:], depth + 1))
+
+    # 最近鄰查詢：回傳與target歐氏距離最近的k筆，格式為List of (距離平方, 資料)，由近到遠
+    def nearest(self, target, k=1):
+        heap = []  # 最大堆積(以負距離儲存)，保留目前最近的k筆
+        counter = 0  # 距離相同時的排序依據
+
+        def search(node):
+            nonlocal counter
+            if node is None:
+                return
+
+            point, item, axis, left, right = node
+            dist = sum((a - b) ** 2 for a, b in zip(point, target))
+            if len(heap) < k:
+                heapq.heappush(heap, (-dist, counter, item))
+            elif dist < -heap[0][0]:
+                heapq.heapreplace(heap, (-dist, counter, item))
+            counter += 1
+
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            search(near)
+            # 另一側可能存在更近的點時才繼續搜尋
+            if len(heap) < k or diff ** 2 < -heap[0][0]:
+                search(far)
+
+        if k > 0:
+            search(self.root)
+        return [(-dist, item) for dist, _, item in sorted(heap, reverse=True)]
+
+    # 矩形範圍查詢：回傳座標落在[lower, upper]之間的所有資料
+    def within(self, lower, upper):
+        result = []
+
+        def search(node):
+            if node is None:
+                return
+
+            point, item, axis, left, right = node
+            if all(lo <= value <= hi for value, lo, hi in zip(point, lower, upper)):
+                result.append(item)
+            if lower[axis] <= point[axis]:
+                search(left)
+            if point[axis] <= upper[axis]:
+                search(right)
+
+        search(self.root)
+        return result
+
+
+# 經緯度轉換為單位球面上的三維座標：直線距離與球面距離單調對應，可直接用於最近鄰查詢
+def to_unit_vector(lon, lat):
+    lon, lat = math.radians(lon), math.radians(lat)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+# 單位球面直線距離的平方轉換為球面距離(公里)
+def chord_to_km(chord_squared):
+    chord = math.sqrt(chord_squared)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2, 1.0))
+
+
+class StationIndex:
+    '''
+    觀測站空間索引：station_list的資料版本異動時重新建立
+    '''
+
+    def __init__(self, sql_operate) -> None:
+        self.sql_operate = sql_operate
+        self.version = None
+        self.size = 0  # 索引內的觀測站數量
+        self.sphere_tree = KDTree([], [])  # 三維座標，用於最近鄰查詢
+        self.lonlat_tree = KDTree([], [])  # 經緯度座標，用於矩形範圍查詢
+        self.lock = threading.Lock()
+
+    # 確認索引為最新版本，若資料表已異動則重新建立
+    def refresh(self):
+        version = self.sql_operate.get_versions(['station_list'])
+        if version == self.version:
+            return
+
+        with self.lock:
+            if version == self.version:
+                return
+
+            syntax = """
+                SELECT sID, stn_name, alt, lon, lat, state
+                FROM station_list
+                WHERE lon IS NOT NULL AND lat IS NOT NULL
+            """
+            stations = self.sql_operate.query(syntax)
+            self.sphere_tree = KDTree(
+                [to_unit_vector(item['lon'], item['lat']) for item in stations], stations)
+            self.lonlat_tree = KDTree(
+                [(item['lon'], item['lat']) for item in stations], stations)
+            self.size = len(stations)
+            self.version = version
+
+    # 查詢最近的k個觀測站：回傳List of Dict，並附上距離(公里)；active為True時僅包含現存測站
+    def nearest(self, lon, lat, k=5, active=False):
+        self.refresh()
+        tree = self.sphere_tree
+        target = to_unit_vector(lon, lat)
+
+        # 僅查詢現存測站時，逐步擴大搜尋數量直到滿足k筆或搜尋完所有測站
+        size = max(k, 1)
+        while True:
+            candidates = tree.nearest(target, size)
+            if active:
+                candidates = [(dist, item) for dist, item in candidates if item['state'] == 1]
+            if len(candidates) >= k or size >= self.size:
+                break
+            size *= 2
+
+        return [dict(item, distance_km=round(chord_to_km(dist), 3)) for dist, item in candidates[:k]]
+
+    # 查詢經緯度範圍內的觀測站：回傳List of Dict
+    def within(self, min_lon, min_lat, max_lon, max_lat):
+        self.refresh()
+        return self.lonlat_tree.within((min_lon, min_lat), (max_lon, max_lat))
@@ -0,0 +1,131 @@
+"""
+歷史觀測資料儲存格式效能比較：舊版 data_history(TEXT測站代碼、含測站名稱、rowid資料表)
+與 history_compact(測站整數鍵、WITHOUT ROWID叢集主鍵)的資料庫大小與範圍查詢時間
+
+執行方式：python -m benchmarks.history_storage --stations 100 --years 34
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 舊版歷史觀測資料表
+LEGACY_SYNTAX = """
+    CREATE TABLE "data_history" (
+        "sID"	TEXT, "stn_name"	TEXT, "obs_date"	INTEGER,
+        "StnPres"	REAL, "SeaPres"	REAL, "Temperature"	REAL, "Tmax"	REAL, "Tmin"	REAL,
+        "RH"	REAL, "WS"	REAL, "WD"	INTEGER, "WSmax"	REAL, "WDmax"	INTEGER,
+        "Precp"	REAL, "PrecpHour"	REAL, "SunShineHour"	REAL, "SunshineRate"	REAL,
+        "GloblRad"	REAL, "VisbMean"	REAL, "UVImax"	REAL, "CloudAmount"	REAL,
+        PRIMARY KEY("sID","obs_date")
+    );
+"""
+
+# 範圍查詢：單一測站一年份的資料
+RANGE_SYNTAX = """
+    SELECT obs_date, Temperature, Tmax, Tmin, Precp, RH
+    FROM data_history
+    WHERE sID = ? AND obs_date BETWEEN ? AND ?
+"""
+
+START_DATE = 631123200  # 1990-01-01(臺灣時間)
+
+
+# 產生模擬的觀測站與每日觀測資料
+def generate(stations, years):
+    station_list = [{
+        'sID': f'C0{idx:04d}', 'stn_name': f'測站{idx}', 'alt': 10.0,
+        'lon': 120 + random.random() * 2, 'lat': 22 + random.random() * 3,
+        'county': '縣市', 'addr': '地址', 'start_date': '1990-01-01', 'end_date': None,
+        'remark': None, 'state': 1,
+    } for idx in range(stations)]
+
+    days = years * 365
+    rows = []
+    for station in station_list:
+        for day in range(days):
+            rows.append((
+                station['sID'], station['stn_name'], START_DATE + day * 86400,
+                1000 + random.random() * 20, 1010 + random.random() * 20,
+                round(15 + random.random() * 15, 1), round(20 + random.random() * 15, 1),
+                round(10 + random.random() * 15, 1), round(50 + random.random() * 50, 1),
+                round(random.random() * 8, 1), random.randint(0, 360), round(random.random() * 25, 1),
+                random.randint(0, 360), random.choice([0.0, 0.0, 0.05, round(random.random() * 80, 1)]),
+                round(random.random() * 24, 1), round(random.random() * 12, 1), round(random.random() * 100, 1),
+                round(random.random() * 30, 2), round(random.random() * 30, 1), random.randint(0, 12),
+                round(random.random() * 10, 1)))
+
+    return station_list, rows
+
+
+# 量測範圍查詢時間：隨機測站與起始日期，回傳中位數(毫秒)
+def measure(path, station_list, years, repeat):
+    connection = sqlite3.connect(path)
+    latencies = []
+    for _ in range(repeat):
+        sid = random.choice(station_list)['sID']
+        start = START_DATE + random.randint(0, max(years - 1, 0) * 365) * 86400
+        began = time.perf_counter()
+        connection.execute(RANGE_SYNTAX, (sid, start, start + 365 * 86400)).fetchall()
+        latencies.append((time.perf_counter() - began) * 1000)
+    connection.close()
+    return statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='歷史觀測資料儲存格式效能比較')
+    parser.add_argument('--stations', type=int, default=100, help='測站數量')
+    parser.add_argument('--years', type=int, default=34, help='每個測站的資料年數')
+    parser.add_argument('--repeat', type=int, default=500, help='範圍查詢次數')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='history_storage_')
+    os.chdir(workdir)
+    os.makedirs('data')
+    path = os.path.join('data', 'weather.db')
+
+    from backend.dataprocessing import DataPipeline
+    from backend.models import StationList
+
+    print(f'產生模擬資料：{args.stations} 個測站 × {args.years} 年')
+    station_list, rows = generate(args.stations, args.years)
+
+    # 舊版格式
+    data_pipeline = DataPipeline()
+    data_pipeline.build_station_list()
+    data_pipeline.sql_operate.upsert(StationList, station_list)
+    connection = sqlite3.connect(path)
+    connection.execute(LEGACY_SYNTAX)
+    connection.executemany(f'INSERT INTO data_history VALUES ({", ".join("?" * 21)})', rows)
+    connection.commit()
+    connection.execute('VACUUM')
+    connection.close()
+    legacy_size = os.path.getsize(path)
+    legacy_latency = measure(path, station_list, args.years, args.repeat)
+
+    # 轉換為新格式(含重整資料庫檔案)
+    began = time.perf_counter()
+    data_pipeline.build_historical_obs_table()
+    migrate_seconds = time.perf_counter() - began
+    compact_size = os.path.getsize(path)
+    compact_latency = measure(path, station_list, args.years, args.repeat)
+
+    print(f'資料筆數：{len(rows)}，轉換時間：{migrate_seconds:.1f} 秒')
+    print(f'{"格式":<16}{"資料庫大小(MB)":>16}{"一年範圍查詢(ms)":>18}')
+    print(f'{"data_history":<16}{legacy_size / 2 ** 20:>16.1f}{legacy_latency:>18.3f}')
+    print(f'{"history_compact":<16}{compact_size / 2 ** 20:>16.1f}{compact_latency:>18.3f}')
+    print(f'資料庫大小減少 {1 - compact_size / legacy_size:.1%}，範圍查詢時間為原本的 {compact_latency / legacy_latency:.2f} 倍')
+
+    os.chdir('/')
+    shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+import io
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc
+
+# 向後端請求資料時使用的標頭：優先使用Arrow IPC串流，其次為CSV，最後為JSON
+ACCEPT_HEADERS = {
+    'Accept': 'application/vnd.apache.arrow.stream, text/csv;q=0.5, application/json;q=0.1'
+}
+
+
+# 依回傳的Content-Type讀取資料(Arrow IPC串流/Parquet/CSV/JSON)，轉換為DataFrame
+def read_dataframe(response):
+    content_type = response.headers.get('content-type', '')
+
+    if 'arrow' in content_type:
+        return pa.ipc.open_stream(response.content).read_pandas()
+    if 'parquet' in content_type:
+        return pd.read_parquet(io.BytesIO(response.content))
+    if 'csv' in content_type:
+        return pd.read_csv(io.BytesIO(response.content))
+
+    content = response.json()
+    if 'columns' in content:
+        return pd.DataFrame(content['data'], columns=content['columns'])
+    return pd.DataFrame(content['data'])
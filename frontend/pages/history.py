@@ -2,6 +2,7 @@ import streamlit as st
 import datetime
 import requests
 import pandas as pd
+from dataformat import ACCEPT_HEADERS, read_dataframe
 
 # 疊圖
 # https://vega.github.io/vega-lite/docs/layer.html
@@ -47,14 +48,67 @@ def get_stn_loc(stn_name):
 
 @st.cache_data
 def get_history_data(stn_code, start_date, end_date):
-    # 抓取單一測站歷史資料
+    # 抓取單一測站歷史資料：僅取圖表使用的欄位
     params = {
         'stn': stn_code,
         'start_date': start_date,
         'end_date': end_date,
+        'fields': 'Temperature,Precp,RH,WS,WSmax',
     }
-    response = requests.get('http://localhost:8000/history', params=params)
-    data = response.json()['data']
+    response = requests.get('http://localhost:8000/history',
+                            params=params, headers=ACCEPT_HEADERS)
+    data = read_dataframe(response)
+
+    return data
+
+
+# 依查詢期間長度決定趨勢圖的時間解析度：一年內為日資料，五年內以週彙整，其餘以月彙整
+def get_trend_freq(start_date, end_date):
+    days = (end_date - start_date).days
+    if days <= 366:
+        return None
+    elif days <= 366 * 5:
+        return 'week'
+    else:
+        return 'month'
+
+
+@st.cache_data
+def get_history_aggregate(stn_code, start_date, end_date, freq):
+    # 抓取單一測站依時間單位彙整的歷史資料，並換成趨勢圖使用的欄位名稱
+    params = {
+        'stn': stn_code,
+        'start_date': start_date,
+        'end_date': end_date,
+        'freq': freq,
+        'stats': 'mean,max,sum',
+    }
+    response = requests.get('http://localhost:8000/history/aggregate',
+                            params=params, headers=ACCEPT_HEADERS)
+    data = read_dataframe(response)
+    data = data.rename(columns={
+        'Temperature_mean': 'Temperature',
+        'Precp_sum': 'Precp',
+        'RH_mean': 'RH',
+        'WS_mean': 'WS',
+        'WSmax_max': 'WSmax',
+    })
+
+    return data
+
+
+@st.cache_data
+def get_history_rollup(stn_code, start_date, end_date, freq):
+    # 抓取單一測站預先計算的月、年彙整資料，欄位名稱與趨勢圖一致
+    params = {
+        'stn': stn_code,
+        'start_date': start_date,
+        'end_date': end_date,
+        'freq': freq,
+    }
+    response = requests.get('http://localhost:8000/history/rollup',
+                            params=params, headers=ACCEPT_HEADERS)
+    data = read_dataframe(response)
 
     return data
 
@@ -103,10 +157,24 @@ with st.sidebar:
             st.text('查無資料，請重新查詢！')
         else:
             st.text('查詢成功！')
-            data = pd.DataFrame(data)
             data['obs_date'] = pd.to_datetime(data['obs_date'], unit='s', utc=True).dt.tz_convert(
                 'Asia/Taipei').dt.strftime('%Y-%m-%d')
 
+            # 查詢期間較長時，趨勢圖改用後端彙整後的資料
+            trend_freq = get_trend_freq(start_date, end_date)
+            if trend_freq is None:
+                trend_data = data
+            elif trend_freq == 'month':
+                trend_data = get_history_rollup(
+                    stn_code, start_date_timestamp, end_date_timestamp, trend_freq)
+                trend_data['obs_date'] = pd.to_datetime(trend_data['obs_date'], unit='s', utc=True).dt.tz_convert(
+                    'Asia/Taipei').dt.strftime('%Y-%m-%d')
+            else:
+                trend_data = get_history_aggregate(
+                    stn_code, start_date_timestamp, end_date_timestamp, trend_freq)
+                trend_data['obs_date'] = pd.to_datetime(trend_data['obs_date'], unit='s', utc=True).dt.tz_convert(
+                    'Asia/Taipei').dt.strftime('%Y-%m-%d')
+
     # 觀測站位置區塊
     st.divider()  # 分隔線
     st.subheader(f'{stn_name} 觀測站位置')
@@ -171,7 +239,7 @@ with trend:
             ]
         }
         st.vega_lite_chart(
-            data, trend_temperature, theme="streamlit", use_container_width=True
+            trend_data, trend_temperature, theme="streamlit", use_container_width=True
         )
 
     except:
@@ -214,7 +282,7 @@ with trend:
             ]
         }
         st.vega_lite_chart(
-            data, trend_rainfall, theme="streamlit", use_container_width=True
+            trend_data, trend_rainfall, theme="streamlit", use_container_width=True
         )
 
     except:
@@ -259,7 +327,7 @@ with trend:
         }
 
         st.vega_lite_chart(
-            data, trend_rainfall, theme="streamlit", use_container_width=True
+            trend_data, trend_rainfall, theme="streamlit", use_container_width=True
         )
     except:
         st.text('無法顯示資料：\n1.您尚未送出查詢\n2.此查詢區間無任何資料\n3.本觀測站未提供此項資料')
@@ -347,7 +415,7 @@ with trend:
         }
 
         st.vega_lite_chart(
-            data, trend_rainfall, theme="streamlit", use_container_width=True
+            trend_data, trend_rainfall, theme="streamlit", use_container_width=True
         )
     except:
         st.text('無法顯示資料：\n1.您尚未送出查詢\n2.此查詢區間無任何資料\n3.本觀測站未提供此項資料')
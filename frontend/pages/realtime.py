@@ -1,7 +1,9 @@
+import time
 import streamlit as st
 import requests
 import pandas as pd
 import pydeck as pdk
+from dataformat import ACCEPT_HEADERS, read_dataframe
 
 # 網頁標頭
 st.set_page_config(
@@ -16,8 +18,9 @@ st.set_page_config(
 @st.cache_data
 def get_realtime_data():
     # 抓取即時觀測資料
-    response = requests.get('http://localhost:8000/realtime')
-    data = pd.DataFrame(response.json()['data'])
+    response = requests.get(
+        'http://localhost:8000/realtime', headers=ACCEPT_HEADERS)
+    data = read_dataframe(response)
     data['obs_time'] = pd.to_datetime(data['obs_time'], unit='s', utc=True).dt.tz_convert(
         'Asia/Taipei').dt.strftime('%Y-%m-%d %H:%M:%S')
     # data.rename(columns={'Temperature': 'temp'}, inplace=True)
@@ -36,11 +39,21 @@ st.title('即時天氣圖資')  # 網頁標題
 if st.button('更新資料'):
     # 顯示更新狀態
     with st.status("資料更新中……") as status:
-        requests.put('http://localhost:8000/realtime')
+        job = requests.put('http://localhost:8000/realtime').json()
         st.write("資料更新中……")
-        status.update(label="更新完成！", state="complete")
-        st.write("更新完成！")
-        data = get_realtime_data()
+
+        # 等待背景工作完成
+        while job['status'] in ('queued', 'running'):
+            time.sleep(1)
+            job = requests.get(f"http://localhost:8000/jobs/{job['id']}").json()
+
+        if job['status'] == 'succeeded':
+            status.update(label="更新完成！", state="complete")
+            st.write("更新完成！")
+        else:
+            status.update(label="更新失敗！", state="error")
+            st.write('更新失敗：', '；'.join(job['errors']))
+        get_realtime_data.clear()  # 清除快取，重新讀取資料
 
 data = get_realtime_data()
 st.write('資料時間：', str(data['obs_time'][0]))  # 無法更新資料時間